@@ -1,18 +1,151 @@
-import uvicorn
+import json
+import os
+import random
+import threading
+import time
 from .adk_base_agent import ADKA2ABaseAgent
-from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
+from .agent_card_generator import AGENT_CONFIGS, agent_port, generate_agent_card
+from .serving import serve, acquire_singleton
+from .telemetry_store import TelemetryStore
 from models.a2a_models import AlarmData
 from typing import Dict, Any
 
 AGENT_NAME = "QoS Monitor Agent"
 CONFIG = AGENT_CONFIGS[AGENT_NAME]
+PORT = agent_port(AGENT_NAME)
+ORCHESTRATOR_NAME = "Orchestration Agent"
+# 链路时序库默认目录：固定在 qos-system/ 下，重启后历史数据仍在 (共享目录每次启动都会新建)
+DEFAULT_TELEMETRY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "telemetry_data")
+
+
+def mm1_latency(link_capacity: float, current_load: float) -> float:
+    """M/M/1 latency estimate (ms, demo scaling) of a link; 1000 ms when (nearly) saturated."""
+    # Utilization (rho) = lambda / mu；防止除以零
+    if current_load / link_capacity >= 0.99:
+        return 1000.0
+    # 公式: T = 1 / (mu - lambda)，乘以 10 作为演示用的 scaling factor，让结果看起来像毫秒
+    return (1.0 / (link_capacity - current_load)) * 10.0
 
 class QoSMonitorAgent(ADKA2ABaseAgent):
     """ADK Dedicated Class for QoS Monitoring (Trigger)"""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 告警推送 (需显式开启)：每 ALARM_PUSH_INTERVAL 秒评估链路，检测到告警即推送给编排者
+        # 默认 0 表示不推送，仅响应轮询 (run_system.sh 通过 start_qos_chain 触发)
+        self.push_interval = float(os.getenv("ALARM_PUSH_INTERVAL", "0"))
+        # 同一告警持续存在时的重复推送间隔
+        self.repeat_interval = float(os.getenv("ALARM_REPEAT_INTERVAL", "60"))
+        orchestrator_config = AGENT_CONFIGS[ORCHESTRATOR_NAME]
+        self.orchestrator_card = generate_agent_card(
+            ORCHESTRATOR_NAME, orchestrator_config["port"], orchestrator_config["description"],
+            orchestrator_config["capability"], orchestrator_config["params"], orchestrator_config["returns"],
+            orchestrator_config.get("extra_capabilities")
+        )
+        # 链路时序库：采样周期 (0 表示不采样，只提供查询)
+        self.sample_interval = float(os.getenv("TELEMETRY_SAMPLE_INTERVAL", "10"))
+        self.telemetry: TelemetryStore = None
+
+    def on_worker_start(self):
+        # 多 worker 时只由一个 worker 负责推送，避免重复告警
+        if self.push_interval > 0 and acquire_singleton("qos-monitor-publisher"):
+            threading.Thread(target=self._publish_alarms, name="alarm-publisher", daemon=True).start()
+        # 时序库只允许一个写入者 (在库目录内选举，跨 worker 与多次启动)；其他进程以只读方式打开同一目录下的 mmap 文件
+        telemetry_dir = os.getenv("TELEMETRY_DIR") or DEFAULT_TELEMETRY_DIR
+        os.makedirs(telemetry_dir, exist_ok=True)
+        writer = acquire_singleton("telemetry-writer", telemetry_dir)
+        self.telemetry = TelemetryStore(telemetry_dir, writable=writer)
+        if writer and self.sample_interval > 0:
+            threading.Thread(target=self._sample_links, name="telemetry-sampler", daemon=True).start()
+
+    def _monitored_links(self):
+        """Links to sample: the topology's links if it has load data, else the simulated Router-A -> Router-B link."""
+        try:
+            with open('topology.json', 'r') as f:
+                links = json.load(f).get("links") or []
+        except (OSError, ValueError):
+            links = []
+        return links or [{"source": "Router-A", "destination": "Router-B", "capacity": 10.0, "load": 9.6}]
+
+    def _sample_links(self):
+        """Periodically appends one (simulated) sample per link to the telemetry store."""
+        links = self._monitored_links()
+        while True:
+            now = time.time()
+            samples = []
+            for link in links:
+                capacity = float(link["capacity"])
+                # 模拟遥测：在拓扑负载附近随机波动
+                load = min(max(float(link["load"]) * random.uniform(0.9, 1.1), 0.0), capacity)
+                samples.append({
+                    "link": f"{link['source']}->{link['destination']}", "ts": now,
+                    "load_mbps": load, "utilization": load / capacity, "latency_ms": mm1_latency(capacity, load)
+                })
+            try:
+                self.telemetry.ingest(samples)
+            except OSError as e:
+                self.log.error("Telemetry ingest failed: %s", e)
+            time.sleep(self.sample_interval)
+
+    def _query_telemetry(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """query_telemetry capability: range series of one link, or the top-N congested links."""
+        if self.telemetry is None:
+            raise ValueError("Telemetry store is not initialized.")
+        end = float(params.get("end") or time.time())
+        start = float(params.get("start") or end - float(params.get("window_s", 3600)))
+        metric = params.get("metric", "utilization")
+        query = params.get("query", "range")
+        if query == "range":
+            if not params.get("link"):
+                raise ValueError("Missing link in payload.")
+            return {"telemetry": self.telemetry.query_range(params["link"], start, end, metric, params.get("resolution"))}
+        if query == "top_congested":
+            return {"telemetry": {
+                "start": start, "end": end, "metric": metric,
+                "links": self.telemetry.top_congested(start, end, int(params.get("n", 5)), metric, params.get("stat", "p95"), params.get("resolution"))
+            }}
+        raise ValueError(f"Unknown telemetry query: {query}")
+
+    def _publish_alarms(self):
+        """
+        Pushes alarms to the Orchestrator's bounded queue. Publishing is
+        edge-triggered (new alarm) plus a slow repeat while the alarm persists;
+        a rejected push (queue full) or an unreachable Orchestrator makes the
+        publisher back off instead of piling up requests.
+        """
+        last_published: Dict[str, float] = {}
+        while True:
+            delay = self.push_interval
+            result = self.process_message({})
+            if "alarm_data" in result:
+                alarm_id = result["alarm_data"]["alarm_id"]
+                now = time.time()
+                if now - last_published.get(alarm_id, 0.0) >= self.repeat_interval:
+                    event = {**result, "detected_at": now}
+                    try:
+                        response = self.send_a2a_message(
+                            self.orchestrator_card,
+                            {"capability": "ingest_alarm", "params": {"alarm": event}},
+                            timeout=5
+                        )
+                        ack = response.get("result", {})
+                        if ack.get("accepted"):
+                            last_published[alarm_id] = now
+                        else:
+                            delay = max(delay, ack.get("retry_after", delay))
+                            self.log.warning("Orchestrator saturated, backing off %.1fs", delay, queue_depth=ack.get('queue_depth'))
+                    except ConnectionError:
+                        delay = max(delay, 5.0)
+            else:
+                last_published.clear()
+            time.sleep(delay)
+
     def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if payload.get("capability") == "query_telemetry":
+            return self._query_telemetry(payload.get("params", {}))
+
         # === NEW LOGIC START: M/M/1 Simulation ===
-        print(f"[{self.agent_name}] Simulation: Reading Telemetry & Calculating M/M/1 Latency...")
+        self.log.debug("Simulation: Reading Telemetry & Calculating M/M/1 Latency...")
 
         # 1. 定义场景数据 (模拟 Router-A 到 Router-B 的直连链路)
         # 这里的数值对应我们在 Neo4j 里创建的 "拥塞路径"
@@ -22,23 +155,15 @@ class QoSMonitorAgent(ADKA2ABaseAgent):
         max_latency_threshold = 20.0 # ms (SLA要求)
 
         # 2. M/M/1 排队论计算
-        # Utilization (rho) = lambda / mu
         utilization = current_load / link_capacity
-        
-        # 防止除以零
-        if utilization >= 0.99:
-            estimated_latency = 1000.0 
-        else:
-            # 公式: T = 1 / (mu - lambda)
-            # 我们乘以 10 作为演示用的 scaling factor，让结果看起来像毫秒
-            estimated_latency = (1.0 / (link_capacity - current_load)) * 10.0
+        estimated_latency = mm1_latency(link_capacity, current_load)
 
-        print(f"[{self.agent_name}] Link Status: Load={current_load}/{link_capacity} Mbps (Util: {utilization:.1%})")
-        print(f"[{self.agent_name}] M/M/1 Calculated Latency: {estimated_latency:.2f} ms")
+        self.log.debug("Link Status: Load=%s/%s Mbps (Util: %.1f%%), M/M/1 Calculated Latency: %.2f ms",
+                       current_load, link_capacity, utilization * 100, estimated_latency)
 
         # 3. 判定逻辑
         if estimated_latency > max_latency_threshold:
-            print(f"[{self.agent_name}] ⚠️ SLA VIOLATION DETECTED! Triggering Congestion Alarm.")
+            self.log.warning("⚠️ SLA VIOLATION DETECTED! Triggering Congestion Alarm.", latency_ms=round(estimated_latency, 2))
             
             # 构造标准告警对象
             alarm = AlarmData(
@@ -58,13 +183,13 @@ class QoSMonitorAgent(ADKA2ABaseAgent):
                 "destination": "Router-B"
             }
         
-        print(f"[{self.agent_name}] Link is Healthy.")
+        self.log.debug("Link is Healthy.")
         return {"status": "Healthy", "latency": estimated_latency}
         # === NEW LOGIC END ===
 
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
-agent = QoSMonitorAgent(AGENT_NAME, "localhost", CONFIG["port"], card)
+card = generate_agent_card(AGENT_NAME, PORT, CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"], CONFIG.get("extra_capabilities"))
+agent = QoSMonitorAgent(AGENT_NAME, "localhost", PORT, card)
 
 if __name__ == "__main__":
-    print(f"Starting {AGENT_NAME} on port {CONFIG['port']}...")
-    uvicorn.run(agent.app, host=agent.host, port=agent.port)
\ No newline at end of file
+    print(f"Starting {AGENT_NAME} on port {PORT}...")
+    serve(f"{__spec__.name}:agent.app", agent.app, agent.host, agent.port, prepare=agent.prepare_shared_state)
\ No newline at end of file
@@ -1,26 +1,29 @@
-import uvicorn
 import json
 import os
 import sys
 from fastapi import FastAPI
-from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel, Field
 from typing import Dict, Any, List
 from models.a2a_models import A2AMessage, RemediationPlan
-from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
+from .agent_card_generator import AGENT_CONFIGS, agent_port, generate_agent_card
+from .agent_registry import RegistrationHeartbeat
+from .prompt_builder import PromptBuilder, compact_rows
+from .serving import serve, worker_lifespan
+from .lazy import LazyResource, gemini_llm
+from .cassette import cassette_tool
+from .reroute_solver import RerouteSolver, to_remediation_plans
+from .agent_logging import get_logger, log_context, new_id
+from .admission import AdmissionController, request_priority, overloaded_response
+from .resilience import OverloadedError
 
-# === 新增 MCP 相关的库 ===
-from langchain_mcp_adapters.tools import load_mcp_tools
+# langgraph / langchain_google_genai / langchain_mcp_adapters / dotenv 都是重量级依赖，
+# 延迟到首次使用 (或端口打开后的后台预热) 时才导入，缩短冷启动时间
 
 # --- 配置 ---
 AGENT_NAME = "QoS Remediation Agent"
+log = get_logger(AGENT_NAME)
 
-# 必须加载 .env 以获取 GEMINI_API_KEY
-from dotenv import load_dotenv
-load_dotenv() 
-
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
+prompt_builder = PromptBuilder(AGENT_NAME, token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "1024")))
 
 # === 移除：旧的 Neo4j 硬编码配置 ===
 # NEO4J_URI = ... (删除)
@@ -31,29 +34,55 @@ llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=os.getenv("GEMINI
 # 假设你的 mcp server 文件名为 'neo4j_mcp_server.py' 并且在同一目录或已知路径
 MCP_SERVER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "neo4j_mcp_server.py"))
 
-print(f"[{AGENT_NAME}] Loading MCP Tools from {MCP_SERVER_PATH}...")
-
-# 配置 MCP 客户端参数
-server_params = {
-    "command": "python",
-    "args": [MCP_SERVER_PATH], 
-    "env": os.environ.copy() # 传递环境变量给子进程
-}
-
-# 建立连接并获取工具列表
-try:
-    mcp_tools_list = load_mcp_tools(server_params)
-    # 找到我们在 server 里定义的那个工具 "query_knowledge_graph"
-    # 如果找不到，说明 server 没启动成功或者名字不对
-    neo4j_tool = next((t for t in mcp_tools_list if t.name == "query_knowledge_graph"), None)
-    
-    if not neo4j_tool:
-        raise ValueError("Tool 'query_knowledge_graph' not found in MCP Server!")
+def _load_env():
+    # 必须加载 .env 以获取 GEMINI_API_KEY
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def _build_llm():
+    _load_env()
+    return gemini_llm()
+
+def _load_neo4j_tool():
+    """Starts the MCP server subprocess and returns its query_knowledge_graph tool (None if unavailable)."""
+    _load_env()
+    # === 新增 MCP 相关的库 ===
+    from langchain_mcp_adapters.tools import load_mcp_tools
+
+    log.info("Loading MCP Tools from %s...", MCP_SERVER_PATH)
+
+    # 配置 MCP 客户端参数
+    server_params = {
+        "command": "python",
+        "args": [MCP_SERVER_PATH], 
+        "env": os.environ.copy() # 传递环境变量给子进程
+    }
+
+    # 建立连接并获取工具列表
+    try:
+        mcp_tools_list = load_mcp_tools(server_params)
+        # 找到我们在 server 里定义的那个工具 "query_knowledge_graph"
+        # 如果找不到，说明 server 没启动成功或者名字不对
+        neo4j_tool = next((t for t in mcp_tools_list if t.name == "query_knowledge_graph"), None)
         
-    print(f"[{AGENT_NAME}] MCP Tool loaded successfully: {neo4j_tool.name}")
-except Exception as e:
-    print(f"[{AGENT_NAME}] Failed to load MCP tools: {e}")
-    neo4j_tool = None # 标记为不可用
+        if not neo4j_tool:
+            raise ValueError("Tool 'query_knowledge_graph' not found in MCP Server!")
+            
+        log.info("MCP Tool loaded successfully: %s", neo4j_tool.name)
+        return neo4j_tool
+    except Exception as e:
+        log.error("Failed to load MCP tools: %s", e)
+        return None # 标记为不可用
+
+# Gemini 客户端、MCP 子进程和编译后的图属于每个 worker 自己，延迟创建 (见 init_worker)
+llm_resource = LazyResource("Gemini client", _build_llm)
+# 录制/回放模式下工具调用经过 cassette；回放时不启动 MCP 子进程
+neo4j_tool_resource = LazyResource("MCP query_knowledge_graph tool", lambda: cassette_tool("query_knowledge_graph", _load_neo4j_tool))
+
+def init_worker():
+    """Per-worker startup: warms up the heavy resources in the background once the port is open."""
+    for resource in (graph_resource, llm_resource, neo4j_tool_resource):
+        resource.warm_up_in_background()
 
 # --- State Model (保持不变) ---
 class GraphState(BaseModel):
@@ -84,34 +113,36 @@ class StrictRemediationPlan(BaseModel):
 
 # === 核心逻辑 Node ===
 def analyze_and_plan(state: GraphState) -> GraphState:
-    print(f"[{AGENT_NAME}] Step 1: Analyzing Congestion & Consulting Neo4j via MCP...")
+    log.info("Step 1: Analyzing Congestion & Consulting Neo4j via MCP...")
     
     source_node = state.alarm_data.get("source", "Router-A") 
     dest_node = state.alarm_data.get("destination", "Router-B")
     
     # --- Phase 1: 让 Gemini 写查询语句 (保持不变) ---
-    prompt_cypher = f"""
+    prompt_cypher = prompt_builder.build("cypher_query", """
     You are a Network Traffic Engineer.
     [Situation]
-    The direct link from '{source_node}' to '{dest_node}' is congested.
+    The direct link from '$source' to '$dest' is congested.
     We need to find an ALTERNATIVE path in the graph database.
     
     [Task]
-    Write a Cypher query to find paths from node {{id: '{source_node}'}} to node {{id: '{dest_node}'}}.
+    Write a Cypher query to find paths from node {id: '$source'} to node {id: '$dest'}.
     IMPORTANT: The relationships (:CONNECTED_TO) must have available capacity.
     Filter condition: r.capacity - r.load > 5.0 (We need 5Mbps).
     
     Return the path or the next hop interface.
-    """
+    """, {"source": (source_node, 10), "dest": (dest_node, 10)})
     
     try:
+        llm = llm_resource.get()
         llm_query = llm.with_structured_output(PathFindingRequest)
         query_req = llm_query.invoke(prompt_cypher)
-        print(f"[{AGENT_NAME}] Generated Cypher: {query_req.cypher_query}")
+        log.debug("Generated Cypher: %s", query_req.cypher_query)
         
         # --- Phase 2: 执行查询 (改为调用 MCP 工具) ---
-        print(f"[{AGENT_NAME}] Executing Cypher via MCP Tool...")
+        log.debug("Executing Cypher via MCP Tool...")
         
+        neo4j_tool = neo4j_tool_resource.get()
         if neo4j_tool:
             # === 这里是改动的核心 ===
             # 直接调用 tool.invoke，传入 MCP 定义的参数名 (cypher_query)
@@ -123,70 +154,121 @@ def analyze_and_plan(state: GraphState) -> GraphState:
         else:
             db_result = "Error: MCP Tool is not available."
 
-        print(f"[{AGENT_NAME}] MCP Result: {db_result}")
+        log.debug("MCP Result: %s", db_result)
         
         # --- Phase 3: 生成修复计划 (保持不变) ---
-        prompt_plan = f"""
-        Context: Congestion on {source_node} -> {dest_node}.
-        Neo4j Path Search Result: {db_result}
+        # 压缩查询结果：去重、按路径长度排序、只保留前几条，避免超出 token 预算
+        prompt_plan = prompt_builder.build("remediation_plan", """
+        Context: Congestion on $source -> $dest.
+        Neo4j Path Search Result:
+        $db_result
         
         Task: Create a Remediation Plan.
-        1. If a path was found, identify the OUTGOING INTERFACE on {source_node}.
+        1. If a path was found, identify the OUTGOING INTERFACE on $source.
         2. Set 'new_qos_level' to 'PBR_Redirect'.
         3. Explain the reroute path in 'reason'.
         
         If result is empty or indicates error, explain that no path exists.
-        """
+        """, {"source": (source_node, 10), "dest": (dest_node, 10), "db_result": (compact_rows(db_result), 1)})
         
         llm_plan = llm.with_structured_output(StrictRemediationPlan)
         strict_plan = llm_plan.invoke(prompt_plan)
         
-        print(f"[{AGENT_NAME}] Gemini Decision: {strict_plan.actions.reason}")
+        log.info("Gemini Decision: %s", strict_plan.actions.reason)
 
         state.plan = RemediationPlan(**strict_plan.model_dump())
         state.step = "PLAN_GENERATED"
 
     except Exception as e:
-        print(f"[{AGENT_NAME}] Critical Error: {e}")
         import traceback
-        traceback.print_exc()
+        log.error("Critical Error: %s", e, traceback=traceback.format_exc())
         state.error = str(e)
         state.step = "ERROR"
         
     return state
 
 # --- LangGraph Definition (保持不变) ---
-workflow = StateGraph(GraphState)
-workflow.add_node("analyze_plan", analyze_and_plan)
-workflow.set_entry_point("analyze_plan")
-workflow.add_edge("analyze_plan", END) 
-app_graph = workflow.compile()
+def _build_graph():
+    from langgraph.graph import StateGraph, END
+    workflow = StateGraph(GraphState)
+    workflow.add_node("analyze_plan", analyze_and_plan)
+    workflow.set_entry_point("analyze_plan")
+    workflow.add_edge("analyze_plan", END) 
+    return workflow.compile()
+
+graph_resource = LazyResource("LangGraph workflow", _build_graph)
 
 # --- FastAPI Wrapper (保持不变) ---
 CONFIG = AGENT_CONFIGS[AGENT_NAME]
-app = FastAPI(title=f"{AGENT_NAME} A2A Server")
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
+PORT = agent_port(AGENT_NAME)
+card = generate_agent_card(AGENT_NAME, PORT, CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"], CONFIG.get("extra_capabilities"))
+registration = RegistrationHeartbeat(card)
+app = FastAPI(title=f"{AGENT_NAME} A2A Server", lifespan=worker_lifespan([init_worker, registration.start], [registration.stop]))
+# 准入控制：LangGraph + MCP 调用很重，超出并发的请求按优先级排队，无法按时完成的直接拒绝
+admission = AdmissionController(
+    AGENT_NAME,
+    max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+)
+app.add_api_route("/admission", admission.stats, methods=["GET"])
+app.add_api_route("/prompts", lambda: prompt_builder.stats, methods=["GET"])
 
 @app.get("/.well-known/agent.json")
 async def get_agent_card():
     return card
 
+# 同步 handler：LangGraph 调用是阻塞的，交给线程池执行，避免阻塞事件循环
 @app.post("/a2a")
-async def handle_a2a_message(message: A2AMessage):
+def handle_a2a_message(message: A2AMessage):
+    with log_context(trace_id=message.trace_id or new_id()):
+        log.info("Received message from %s to execute %s", message.sender_id, message.payload.get('capability'))
+        priority = request_priority(message.payload)
+        try:
+            with admission.admit(priority, message.deadline) as ticket:
+                response = dispatch_capability(message)
+        except OverloadedError as e:
+            log.warning("Shed %s: %s", message.payload.get('capability'), e, priority=priority)
+            return overloaded_response(e)
+        response["timing"] = ticket.timing()
+        log.info("Served %s", message.payload.get('capability'), priority=priority, **ticket.timing())
+        return response
+
+def dispatch_capability(message: A2AMessage) -> Dict[str, Any]:
     if message.payload.get('capability') == CONFIG["capability"]:
         params = message.payload.get('params', {})
         initial_state = GraphState(
             alarm_data=params.get("alarm_data", {}),
             topology=params.get("topology", {})
         )
-        final_state_dict = app_graph.invoke(initial_state)
+        final_state_dict = graph_resource.get().invoke(initial_state)
         
         if final_state_dict.get('error'):
             return {"status": "failure", "error": final_state_dict['error']}
         
         return {"status": "success", "result": {"remediation_plan": final_state_dict['plan'].model_dump()}}
+    if message.payload.get('capability') == "generate_batch_remediation_plans":
+        return handle_batch_remediation(message.payload.get('params', {}))
     return {"status": "failure", "error": "Invalid capability."}
 
+def handle_batch_remediation(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Solves all congested links together (no LLM on this path) so that
+    simultaneous reroutes never share the same spare capacity.
+    """
+    topology = params.get("topology", {})
+    if not topology.get("links"):
+        return {"status": "failure", "error": "Topology has no link capacity/load data."}
+    solver = RerouteSolver.from_topology(topology)
+    # 未指定或为空列表：处理全部拥塞链路 (与 Agent Card 的约定一致)
+    solution = solver.solve(solver.congested_demands(params.get("congested_links") or None))
+    plans = to_remediation_plans(solution)
+    unrouted = [f"{e['source']}->{e['destination']}" for e in solution if e["unrouted_mbps"] > 0]
+    log.info("Batch reroute: %d demands, %d plans", len(solution), len(plans), unresolved=unrouted)
+    return {"status": "success", "result": {
+        "remediation_plans": [plan.model_dump() for plan in plans],
+        "unresolved_links": unrouted
+    }}
+
 if __name__ == "__main__":
-    print(f"Starting {AGENT_NAME} (LangGraph + MCP) on port {CONFIG['port']}...")
-    uvicorn.run(app, host="localhost", port=CONFIG["port"])
\ No newline at end of file
+    print(f"Starting {AGENT_NAME} (LangGraph + MCP) on port {PORT}...")
+    serve(f"{__spec__.name}:app", app, "localhost", PORT)
\ No newline at end of file
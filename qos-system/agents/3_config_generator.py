@@ -1,22 +1,33 @@
-import uvicorn
-import json
 from .adk_base_agent import ADKA2ABaseAgent
-from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
-from models.a2a_models import RemediationPlan, CLIConfig
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import Dict, Any
+from .agent_card_generator import AGENT_CONFIGS, agent_port, generate_agent_card
+from .serving import serve
+from .lazy import LazyResource, gemini_llm
+from .prompt_builder import PromptBuilder, compact_json
+from models.a2a_models import RemediationPlan, CLIConfig, CLIConfigBatch
+from typing import Dict, Any, List
 import os
 
 AGENT_NAME = "Config Generation Agent"
 CONFIG = AGENT_CONFIGS[AGENT_NAME]
+PORT = agent_port(AGENT_NAME)
 
 class ConfigGenerationAgent(ADKA2ABaseAgent):
     """ADK Dedicated Class for Configuration Generation (Transformer)"""
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # 初始化 Gemini
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
+        self.prompt_builder = PromptBuilder(self.agent_name, token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "1024")))
+        # Gemini 客户端延迟创建：端口打开后在后台预热，首次调用时若未就绪则等待
+        self._llm = LazyResource(f"{self.agent_name} Gemini client", gemini_llm)
+        self.app.add_api_route("/prompts", lambda: self.prompt_builder.stats, methods=["GET"])
+
+    @property
+    def llm(self):
+        return self._llm.get()
+
+    def on_worker_start(self):
+        # 每个 worker 各自持有客户端，不跨进程共享
+        self._llm.warm_up_in_background()
 
     def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         params = payload.get("params", {})
@@ -27,14 +38,14 @@ class ConfigGenerationAgent(ADKA2ABaseAgent):
         # 这里的转换主要是为了校验格式，实际发给 Prompt 可以直接用 dict
         remediation_plan = RemediationPlan(**remediation_plan_dict)
         
-        print(f"[{self.agent_name}] Converting plan {remediation_plan.plan_id} to CLI text using Gemini.")
+        self.log.info("Converting plan %s to CLI text using Gemini.", remediation_plan.plan_id)
         
         # === NEW CODE START: 使用 Gemini 生成 ===
-        prompt = f"""
+        prompt = self.prompt_builder.build("cli_config", """
         You are a Senior Network Engineer expert in Cisco IOS.
         
         [Input Data: Remediation Plan]
-        {json.dumps(remediation_plan_dict, indent=2)}
+        $plan
 
         [Task]
         Convert the above Remediation Plan into a COMPLETE, EXECUTABLE Cisco IOS configuration block.
@@ -56,32 +67,80 @@ class ConfigGenerationAgent(ADKA2ABaseAgent):
         write memory
         
         Output valid JSON matching CLIConfig schema.
-        """
+        """, {"plan": (compact_json(remediation_plan_dict), 1)})
 
         try:
             # 绑定输出结构，强制 LLM 返回 CLIConfig 对象
             structured_llm = self.llm.with_structured_output(CLIConfig)
             
-            print(f"[{self.agent_name}] Invoking Gemini API... (Translating JSON to CLI)")
+            self.log.debug("Invoking Gemini API... (Translating JSON to CLI)")
             generated_config = structured_llm.invoke(prompt)
 
             if not generated_config:
                 raise ValueError("Gemini returned empty response.")
 
             # 调试打印，验证是不是真的生成了
-            print(f"DEBUG: Gemini Generated CLI:\n{generated_config.cli_text}")
+            self.log.debug("Gemini Generated CLI", cli_text=generated_config.cli_text)
 
             # 使用 model_dump 替代 dict()
             return {"cli_config": generated_config.model_dump()}
 
         except Exception as e:
-            print(f"[{self.agent_name}] Error generating config with Gemini: {e}")
+            self.log.error("Error generating config with Gemini: %s", e)
             raise e
         # === NEW CODE END ===
 
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
-agent = ConfigGenerationAgent(AGENT_NAME, "localhost", CONFIG["port"], card)
+    def process_batch(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Translates all remediation plans of a batch with a single Gemini call."""
+        try:
+            plans = [RemediationPlan(**payload["params"]["remediation_plan"]) for payload in payloads]
+        except (KeyError, TypeError, ValueError):
+            # 批次中有格式错误的请求：逐条处理，让每条请求得到各自的错误信息
+            return super().process_batch(payloads)
+        if len(plans) < 2:
+            return super().process_batch(payloads)
+
+        self.log.info("Converting %d plans to CLI text in one Gemini call.", len(plans))
+        plans_text = "\n".join(f"[Plan {i}] {compact_json(plan.model_dump())}" for i, plan in enumerate(plans, 1))
+        prompt = self.prompt_builder.build("cli_config_batch", """
+        You are a Senior Network Engineer expert in Cisco IOS.
+
+        [Input Data: $count Remediation Plans]
+        $plans
+
+        [Task]
+        Convert EACH Remediation Plan into a COMPLETE, EXECUTABLE Cisco IOS configuration block for its device.
+
+        [CRITICAL SYNTAX REQUIREMENTS] (for every block)
+        1. Start with 'configure terminal'.
+        2. Enter the specific interface (e.g., if plan says 'interface_to_Router-C', you must infer or use a placeholder like 'GigabitEthernet1/0/2' if known, or keep the variable).
+        3. Apply the changes (ip route, etc.).
+        4. End with 'end'.
+        5. MUST include 'write memory' to save config.
+
+        Output valid JSON matching the CLIConfigBatch schema: `configs` holds exactly $count
+        CLIConfig objects, one per plan, in the same order (Plan 1 first).
+        """, {"count": (str(len(plans)), 10), "plans": (plans_text, 1)},
+            token_budget=self.prompt_builder.token_budget * len(plans))
+
+        try:
+            structured_llm = self.llm.with_structured_output(CLIConfigBatch)
+            batch_result = structured_llm.invoke(prompt)
+            if not batch_result:
+                raise ValueError("Gemini returned empty response.")
+        except Exception as e:
+            self.log.error("Error generating batch configs with Gemini: %s", e)
+            return [{"status": "failure", "error": str(e)} for _ in payloads]
+
+        if len(batch_result.configs) != len(plans):
+            # 结果无法与输入一一对应，退回逐条生成
+            self.log.warning("Gemini returned %d configs for %d plans, generating one by one.", len(batch_result.configs), len(plans))
+            return super().process_batch(payloads)
+        return [{"status": "success", "result": {"cli_config": c.model_dump()}} for c in batch_result.configs]
+
+card =generate_agent_card(AGENT_NAME, PORT, CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
+agent = ConfigGenerationAgent(AGENT_NAME, "localhost", PORT, card)
 
 if __name__ == "__main__":
-    print(f"Starting {AGENT_NAME} on port {CONFIG['port']}...")
-    uvicorn.run(agent.app, host=agent.host, port=agent.port)
\ No newline at end of file
+    print(f"Starting {AGENT_NAME} on port {PORT}...")
+    serve(f"{__spec__.name}:agent.app", agent.app, agent.host, agent.port, prepare=agent.prepare_shared_state)
\ No newline at end of file
@@ -1,22 +1,34 @@
-import uvicorn
 import json
 from .adk_base_agent import ADKA2ABaseAgent
-from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
-from models.a2a_models import CLIConfig, ValidationResult
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import Dict, Any
+from .agent_card_generator import AGENT_CONFIGS, agent_port, generate_agent_card
+from .serving import serve
+from .lazy import LazyResource, gemini_llm
+from .prompt_builder import PromptBuilder, compact_cli
+from models.a2a_models import CLIConfig, ValidationResult, ValidationResultBatch
+from typing import Dict, Any, List
 import os
 
 AGENT_NAME = "Config Validation Agent"
 CONFIG = AGENT_CONFIGS[AGENT_NAME]
+PORT = agent_port(AGENT_NAME)
 
 class ConfigValidationAgent(ADKA2ABaseAgent):
     """ADK Dedicated Class for Configuration Validation (Quality Control)"""
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # 初始化 Gemini
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
+        self.prompt_builder = PromptBuilder(self.agent_name, token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "1024")))
+        # Gemini 客户端延迟创建：端口打开后在后台预热，首次调用时若未就绪则等待
+        self._llm = LazyResource(f"{self.agent_name} Gemini client", gemini_llm)
+        self.app.add_api_route("/prompts", lambda: self.prompt_builder.stats, methods=["GET"])
+
+    @property
+    def llm(self):
+        return self._llm.get()
+
+    def on_worker_start(self):
+        # 每个 worker 各自持有客户端，不跨进程共享
+        self._llm.warm_up_in_background()
 
     def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         params = payload.get("params", {})
@@ -26,18 +38,18 @@ class ConfigValidationAgent(ADKA2ABaseAgent):
             
         cli_config = CLIConfig(**cli_config_dict)
         
-        print(f"[{self.agent_name}] Validating CLI config using Gemini.")
+        self.log.info("Validating CLI config using Gemini.")
         
         # === 1. 构建 Prompt：让 Gemini 扮演代码审计员 ===
-        prompt = f"""
+        prompt = self.prompt_builder.build("validation", """
         You are a Network Automation QA (Quality Assurance) Auditor.
         Your job is to validate the following generated network configuration before it is sent to a real device.
 
         [Input Configuration]
-        Device Type: {cli_config.device_type}
+        Device Type: $device_type
         CLI Commands:
         '''
-        {cli_config.cli_text}
+        $cli_text
         '''
 
         [Validation Criteria]
@@ -50,35 +62,87 @@ class ConfigValidationAgent(ADKA2ABaseAgent):
         Analyze the config and return a JSON object matching the ValidationResult schema:
         - is_valid: boolean (true if safe to deploy, false otherwise)
         - report: string (A brief summary of what is good or what is wrong)
-        """
+        """, {"device_type": (cli_config.device_type, 10), "cli_text": (compact_cli(cli_config.cli_text), 1)})
 
         try:
             # === 2. 真正调用 Gemini ===
             # 强制要求返回 ValidationResult (包含 is_valid 和 report)
             structured_llm = self.llm.with_structured_output(ValidationResult)
             
-            print(f"[{self.agent_name}] Invoking Gemini API... (Auditing Config)")
+            self.log.debug("Invoking Gemini API... (Auditing Config)")
             validation_result = structured_llm.invoke(prompt)
 
             if not validation_result:
                 raise ValueError("Gemini returned empty response.")
 
             # === 3. 调试打印：看看 Gemini 对代码的评价 ===
-            print(f"DEBUG: Gemini Validation Report: [{validation_result.is_valid}] {validation_result.report}")
+            self.log.debug("Gemini Validation Report: [%s] %s", validation_result.is_valid, validation_result.report)
 
             # === 4. 返回结果 ===
             # 使用 model_dump() 替代 dict()
             return {"validation_result": validation_result.model_dump()}
 
         except Exception as e:
-            print(f"[{self.agent_name}] Error validating with Gemini: {e}")
+            self.log.error("Error validating with Gemini: %s", e)
             # 如果 LLM 调用失败，为了安全起见，应该默认为 False (不通过)
             fallback_result = ValidationResult(is_valid=False, report=f"Validation Process Failed: {str(e)}")
             return {"validation_result": fallback_result.model_dump()}
 
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
-agent = ConfigValidationAgent(AGENT_NAME, "localhost", CONFIG["port"], card)
+    def process_batch(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Audits all configs of a batch with a single Gemini call."""
+        try:
+            cli_configs = [CLIConfig(**payload["params"]["cli_config"]) for payload in payloads]
+        except (KeyError, TypeError, ValueError):
+            # 批次中有格式错误的请求：逐条处理，让每条请求得到各自的错误信息
+            return super().process_batch(payloads)
+        if len(cli_configs) < 2:
+            return super().process_batch(payloads)
+
+        self.log.info("Validating %d CLI configs in one Gemini call.", len(cli_configs))
+        configs_text = "\n\n".join(
+            f"[Config {i}] Device Type: {c.device_type}\n'''\n{compact_cli(c.cli_text)}\n'''" for i, c in enumerate(cli_configs, 1)
+        )
+        prompt = self.prompt_builder.build("validation_batch", """
+        You are a Network Automation QA (Quality Assurance) Auditor.
+        Your job is to validate each of the following $count generated network configurations before they are sent to real devices.
+
+        [Input Configurations]
+        $configs
+
+        [Validation Criteria] (apply to each configuration independently)
+        1. **Syntax Check**: Are the commands valid for the specified device type (Cisco IOS)?
+        2. **Safety Check**: Does the config contain dangerous commands (e.g., 'reload', 'shutdown' on critical links) without justification?
+        3. **Completeness**: Does it enter configuration mode ('conf t') and exit properly ('end')?
+        4. **Idempotency**: Does it save the config ('write memory' or 'copy run start')?
+
+        [Output Requirement]
+        Return a JSON object matching the ValidationResultBatch schema: `results` holds exactly
+        $count ValidationResult objects, one per configuration, in the same order (Config 1 first).
+        - is_valid: boolean (true if safe to deploy, false otherwise)
+        - report: string (A brief summary of what is good or what is wrong)
+        """, {"count": (str(len(cli_configs)), 10), "configs": (configs_text, 1)},
+            token_budget=self.prompt_builder.token_budget * len(cli_configs))
+
+        try:
+            structured_llm = self.llm.with_structured_output(ValidationResultBatch)
+            batch_result = structured_llm.invoke(prompt)
+            if not batch_result:
+                raise ValueError("Gemini returned empty response.")
+        except Exception as e:
+            self.log.error("Error validating batch with Gemini: %s", e)
+            # 与单条路径一致：LLM 调用失败时全部判定为不通过
+            fallback_result = ValidationResult(is_valid=False, report=f"Validation Process Failed: {str(e)}")
+            return [{"status": "success", "result": {"validation_result": fallback_result.model_dump()}} for _ in payloads]
+
+        if len(batch_result.results) != len(cli_configs):
+            # 结果无法与输入一一对应，退回逐条校验
+            self.log.warning("Gemini returned %d results for %d configs, validating one by one.", len(batch_result.results), len(cli_configs))
+            return super().process_batch(payloads)
+        return [{"status": "success", "result": {"validation_result": r.model_dump()}} for r in batch_result.results]
+
+card =generate_agent_card(AGENT_NAME, PORT, CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
+agent = ConfigValidationAgent(AGENT_NAME, "localhost", PORT, card)
 
 if __name__ == "__main__":
-    print(f"Starting {AGENT_NAME} on port {CONFIG['port']}...")
-    uvicorn.run(agent.app, host=agent.host, port=agent.port)
\ No newline at end of file
+    print(f"Starting {AGENT_NAME} on port {PORT}...")
+    serve(f"{__spec__.name}:agent.app", agent.app, agent.host, agent.port, prepare=agent.prepare_shared_state)
\ No newline at end of file
@@ -1,16 +1,30 @@
-import uvicorn
 from .adk_base_agent import ADKA2ABaseAgent
-from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
+from .agent_card_generator import AGENT_CONFIGS, agent_port, generate_agent_card
+from .serving import serve
+from .running_config import RunningConfigStore, PERSIST_COMMANDS, build_push_script, count_lines
 from models.a2a_models import CLIConfig, ExecutionStatus
 from typing import Dict, Any
+import os
 import time
 
 AGENT_NAME = "Config Execution Agent"
 CONFIG = AGENT_CONFIGS[AGENT_NAME]
+PORT = agent_port(AGENT_NAME)
+# 固定目录：重启后保留每台设备的 running-config 副本 (多副本设置同一个 RUNNING_CONFIG_DIR 即可共用)
+DEFAULT_RUNNING_CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "running_config_data")
 
 class ConfigExecutionAgent(ADKA2ABaseAgent):
     """ADK Dedicated Class for Configuration Execution (Executor)"""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 每台设备的 running-config 副本：只推送差异，无差异时跳过推送
+        self.config_store: RunningConfigStore = None
+
+    def on_worker_start(self):
+        # 所有 worker 与副本默认共用同一目录
+        self.config_store = RunningConfigStore(os.getenv("RUNNING_CONFIG_DIR") or DEFAULT_RUNNING_CONFIG_DIR)
+
     def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         params = payload.get("params", {})
         cli_config_dict = params.get("cli_config")
@@ -18,28 +32,47 @@ class ConfigExecutionAgent(ADKA2ABaseAgent):
             raise ValueError("Missing cli_config in payload.")
             
         cli_config = CLIConfig(**cli_config_dict)
-        
-        print(f"[{self.agent_name}] Executing configuration on device {cli_config.device_type} via MCP API...")
-        time.sleep(2) # Simulate deployment delay
-        
-        # Simulate execution result
-        if "write memory" in cli_config.cli_text:
-            status = "Success"
-            log = f"Successfully deployed and saved config to device."
-        else:
-            status = "Failure"
-            log = "Deployment failed: Configuration persistence command missing."
-        
+        device_id = params.get("device_id", "default")
+
+        # 生成的配置必须包含持久化命令，否则视为不完整
+        if not any(cmd in cli_config.cli_text for cmd in PERSIST_COMMANDS):
+            execution_status = ExecutionStatus(
+                status="Failure",
+                log="Deployment failed: Configuration persistence command missing."
+            )
+            return {"execution_status": execution_status.model_dump()}
+
+        with self.config_store.lock(device_id):
+            # 调用方可附带设备当前的 running-config (show running-config)，之后的差异以它为准
+            if params.get("running_config"):
+                self.config_store.seed(device_id, params["running_config"])
+            delta = self.config_store.diff(device_id, cli_config.cli_text)
+            if not delta:
+                self.log.info("%s: running-config already matches, push skipped.", device_id)
+                execution_status = ExecutionStatus(
+                    status="Success",
+                    log=f"No changes for {device_id}: running-config already up to date, nothing pushed."
+                )
+                return {"execution_status": execution_status.model_dump()}
+
+            push_script = build_push_script(delta)
+            changed = count_lines(delta)
+            self.log.info("Executing %d changed line(s) on device %s (%s) via MCP API...", changed, device_id, cli_config.device_type)
+            time.sleep(2) # Simulate deployment delay
+
+            # 推送成功后更新本地 running-config 副本
+            self.config_store.apply(device_id, delta)
+
         execution_status = ExecutionStatus(
-            status=status,
-            log=log
+            status="Success",
+            log=f"Successfully deployed {changed} changed line(s) to {device_id} and saved config:\n{push_script}"
         )
         
-        return {"execution_status": execution_status.dict()}
+        return {"execution_status": execution_status.model_dump()}
 
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
-agent = ConfigExecutionAgent(AGENT_NAME, "localhost", CONFIG["port"], card)
+card = generate_agent_card(AGENT_NAME, PORT, CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
+agent = ConfigExecutionAgent(AGENT_NAME, "localhost", PORT, card)
 
 if __name__ == "__main__":
-    print(f"Starting {AGENT_NAME} on port {CONFIG['port']}...")
-    uvicorn.run(agent.app, host=agent.host, port=agent.port)
\ No newline at end of file
+    print(f"Starting {AGENT_NAME} on port {PORT}...")
+    serve(f"{__spec__.name}:agent.app", agent.app, agent.host, agent.port, prepare=agent.prepare_shared_state)
\ No newline at end of file
@@ -1,11 +1,18 @@
-import uvicorn
 import json
 import os
 from .adk_base_agent import OrchestratorBaseAgent
 from .agent_card_generator import AGENT_CONFIGS, generate_agent_card
-from models.a2a_models import AlarmData, RemediationPlan, CLIConfig, ValidationResult, ExecutionStatus
-from typing import Dict, Any, Union
+from .alarm_bus import AlarmQueue, alarm_key
+from .serving import serve, publish_shared_state, load_shared_state, shared_state_mtime, cross_worker_lease, cross_worker_lock
+from .agent_logging import log_context, new_id, pipeline_stats
+from .resilience import OverloadedError
+from .reroute_solver import apply_reroute
+from models.a2a_models import AgentCard, AlarmData, RemediationPlan, CLIConfig, ValidationResult, ExecutionStatus
+from typing import Dict, Any, List, Tuple, Union
 import time
+import threading
+from contextlib import ExitStack
+from urllib.parse import urlsplit
 import requests.exceptions
 
 AGENT_NAME = "Orchestration Agent"
@@ -18,27 +25,142 @@ AGENT_URLS = {
     "Config Validation Agent": "http://localhost:8004/.well-known/agent.json",
     "Config Execution Agent": "http://localhost:8005/.well-known/agent.json",
 }
+# 额外副本的 Agent Card URL，例如 AGENT_REPLICA_URLS='{"Config Generation Agent": ["http://localhost:8013/.well-known/agent.json"]}'
+AGENT_REPLICA_URLS: Dict[str, List[str]] = json.loads(os.getenv("AGENT_REPLICA_URLS", "{}"))
 
 class OrchestrationAgent(OrchestratorBaseAgent):
     """ADK Dedicated Class for QoS System Orchestration (Chain)"""
 
+    # 一次从告警队列中最多取出的告警数 (同时拥塞的链路一起求解)
+    BATCH_SIZE = 16
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # 修正：如果加载拓扑失败，会抛出异常并中止启动
-        self.topology = self._load_topology()
-        
-        # Start Agent Discovery with Retries
-        print(f"[{self.agent_name}] Starting Agent Discovery...")
+        # 多 worker 时优先使用父进程发布的拓扑快照 (批量重路由后的链路负载也写回该快照)
+        self.topology = load_shared_state("topology") or self._load_topology()
+        # 幂等能力：允许对慢请求发送对冲 (hedged) 副本；execute_config 有副作用，不在此列
+        self.hedged_capabilities = {"monitor_and_alarm", "generate_cli_config", "validate_config"}
+        # 告警入队只做 O(1) 操作，不能排在长时间运行的 Chain 后面
+        self.admission_exempt = {"ingest_alarm"}
+
+        # 事件驱动：Monitor 推送的告警进入有界队列，由后台线程持续消费
+        self.alarm_queue = AlarmQueue(
+            maxsize=int(os.getenv("ALARM_QUEUE_SIZE", "32")),
+            overflow_policy=os.getenv("ALARM_QUEUE_POLICY", "reject")
+        )
+        self.app.add_api_route("/metrics", self.get_metrics, methods=["GET"])
+        self._registry_mtime = 0.0
+
+    def _missing_urls(self) -> List[Tuple[str, str]]:
+        """(agent name, card URL) of configured agents/replicas with no registered card at the same host:port."""
+        known = {urlsplit(card.endpoint).netloc for name in self.registry.names() for card in self.registry.cards(name)}
+        return [
+            (name, replica_url)
+            for name, url in AGENT_URLS.items()
+            for replica_url in [url] + AGENT_REPLICA_URLS.get(name, [])
+            if urlsplit(replica_url).netloc not in known
+        ]
+
+    def _discover_all(self, max_retries: int = 7) -> int:
+        """
+        Runs Agent Discovery with Retries for every agent not yet known
+        (including cards loaded from the shared snapshot); newly found cards
+        are added to the snapshot. Returns the number still missing.
+        """
+        missing = self._missing_urls()
+        if not missing:
+            return 0
+        self.log.info("Starting Agent Discovery...", missing=len(missing))
         
         # <<< 关键修正区域：用 try-except 包裹整个循环 >>>
-        for name, url in AGENT_URLS.items():
+        still_missing = 0
+        for name, replica_url in missing:
             try:
-                self.discover_agent(url)
+                self._publish_registry(self.discover_agent(replica_url, max_retries=max_retries))
             except ConnectionError as e:
-                print(f"[{self.agent_name}] Discovery FAILED for {name}. Error: {e}")
-                # 即使发现失败，__init__ 也不应抛出异常，确保服务器启动。
+                still_missing += 1
+                self.log.error("Discovery FAILED for %s. Error: %s", name, e)
+                # 即使发现失败，也不应抛出异常，确保服务器启动。
 
-        print(f"[{self.agent_name}] Agent Discovery Complete. Found: {list(self.known_agents.keys())}")
+        self.log.info("Agent Discovery Complete. Found: %s", self.registry.names())
+        return still_missing
+
+    def _discover_in_background(self):
+        """Keeps retrying agents that are still down, after the port is open (backoff up to 60s)."""
+        delay = 5.0
+        while True:
+            time.sleep(delay)
+            # 其他 worker 可能已经发现了它们
+            self._sync_registry()
+            if self._discover_all(max_retries=1) == 0:
+                return
+            delay = min(delay * 2, 60.0)
+
+    def _publish_registry(self, card: AgentCard, registered: bool = True):
+        """
+        Adds (or removes) one replica in the shared snapshot. The read-modify-write
+        runs under a cross-worker lock so concurrent registrations on different
+        workers are not lost; unchanged snapshots are not rewritten (heartbeats).
+        """
+        with cross_worker_lock("agent-cards"):
+            shared = load_shared_state("agent_cards") or {}
+            current = shared.get(card.name, [])
+            cards = [c for c in current if c["endpoint"] != card.endpoint]
+            if registered:
+                cards.append(card.model_dump())
+            if sorted(cards, key=lambda c: c["endpoint"]) == sorted(current, key=lambda c: c["endpoint"]):
+                return
+            shared[card.name] = cards
+            publish_shared_state("agent_cards", shared)
+
+    def _sync_registry(self):
+        """Picks up replicas (de)registered through other workers; a cheap mtime check when nothing changed."""
+        mtime = shared_state_mtime("agent_cards")
+        if mtime == self._registry_mtime:
+            return
+        self._registry_mtime = mtime
+        for name, card_dicts in (load_shared_state("agent_cards") or {}).items():
+            cards = [AgentCard(**card_dict) for card_dict in card_dicts]
+            endpoints = {card.endpoint for card in cards}
+            for card in cards:
+                self.registry.register(card)
+            for card in self.registry.cards(name):
+                if card.endpoint not in endpoints:
+                    self.registry.deregister(name, card.endpoint)
+
+    def register_replica(self, card: AgentCard) -> Dict[str, Any]:
+        result = super().register_replica(card)
+        self._publish_registry(card)
+        return result
+
+    def deregister_replica(self, card: AgentCard) -> Dict[str, Any]:
+        result = super().deregister_replica(card)
+        self._publish_registry(card, registered=False)
+        return result
+
+    def prepare_shared_state(self):
+        """Pre-fork: discover agents once and share cards + topology with all workers."""
+        # 发现到的 Agent Card 由 _discover_all 逐个写入共享快照
+        self._discover_all()
+        # 每次启动从 topology.json 重新加载，不沿用旧快照中的负载
+        self.topology = self._load_topology()
+        publish_shared_state("topology", self.topology)
+
+    def on_worker_start(self):
+        """
+        Per-worker: load the shared agent cards and start the alarm consumer.
+        Agents missing from the snapshot are retried on a background thread,
+        so an agent that is down does not delay opening the port.
+        """
+        self._sync_registry()
+        if self._missing_urls():
+            threading.Thread(target=self._discover_in_background, name="agent-discovery", daemon=True).start()
+        threading.Thread(target=self._consume_alarms, name="alarm-consumer", daemon=True).start()
+
+    def _reload_topology(self):
+        """Reloads the shared topology snapshot (link loads written by any worker); call under the "topology" lock."""
+        self.topology = load_shared_state("topology") or self.topology
 
     def _load_topology(self) -> Dict[str, Any]:
         """
@@ -51,31 +173,204 @@ class OrchestrationAgent(OrchestratorBaseAgent):
         except Exception as e:
             # 修正后的逻辑：无法加载拓扑文件是致命错误，应该立即抛出。
             error_msg = f"FATAL ERROR: Failed to load critical topology.json file: {e}"
-            print(error_msg)
+            self.log.error(error_msg)
             # 抛出异常，阻止 Orchestrator 正常实例化
             raise FileNotFoundError(error_msg) 
 
+    def get_metrics(self) -> Dict[str, Any]:
+        """Exposes alarm queue depth/counters, admission load, replica load/health and log pipeline counters."""
+        return {
+            "alarm_queue": self.alarm_queue.stats(),
+            "admission": self.admission.stats(),
+            "replicas": self.registry.snapshot(),
+            "logging": pipeline_stats()
+        }
+
+    def _ingest_alarm(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Entry point for alarms pushed by the QoS Monitor Agent.
+        Returns immediately; `accepted=False` tells the publisher to back off.
+        """
+        alarm = params.get("alarm")
+        if not alarm or "alarm_data" not in alarm:
+            raise ValueError("Missing alarm in payload.")
+        accepted, outcome = self.alarm_queue.put(alarm_key(alarm), alarm)
+        depth = self.alarm_queue.depth()
+        self.log.info("Alarm %s %s", alarm['alarm_data'].get('alarm_id'), outcome, queue_depth=depth)
+        result = {"accepted": accepted, "outcome": outcome, "queue_depth": depth}
+        if not accepted:
+            result["retry_after"] = 5.0
+        return result
+
+    def _consume_alarms(self):
+        """
+        Background consumer. A single alarm runs the normal repair chain; when
+        several links are congested at once (and the topology carries link
+        load data) they are remediated together through the batch solver.
+        Alarms that do not name their link always take the normal chain.
+        """
+        while True:
+            alarms = [self.alarm_queue.get()] + self.alarm_queue.drain(self.BATCH_SIZE - 1)
+            self._sync_registry()
+            chain_id = new_id()
+            with log_context(chain_id=chain_id, trace_id=chain_id):
+                try:
+                    located = [a for a in alarms if a.get("source") and a.get("destination")]
+                    remaining, reports = alarms, []
+                    if len(located) > 1 and self.topology.get("links"):
+                        reports = self._remediate_batch(located)
+                        remaining = [a for a in alarms if not (a.get("source") and a.get("destination"))]
+                    reports += [self._run_chain({}, alarm_event=alarm)["final_report"] for alarm in remaining]
+                    detected_at = min((a["detected_at"] for a in alarms if a.get("detected_at")), default=None)
+                    if detected_at:
+                        self.log.info("Detection-to-remediation: %.2fs", time.time() - detected_at,
+                                      statuses=[r["status"] for r in reports])
+                except Exception as e:
+                    self.log.error("Alarm-driven chain crashed: %s", e)
+
+    def _remediate_batch(self, alarms: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Solves all congested links (alarms carrying source/destination) in one
+        call to the Remediation Agent, then deploys the plans together. Every
+        alarm gets a report: the deployment outcome of its plan, a failure if
+        no reroute could be placed, or QoS_NOT_CONGESTED if the topology shows
+        no excess load on its link. The solve runs under a cross-worker lock
+        on the shared topology snapshot, and the capacity taken by the plans
+        is reserved in it before the lock is released (and given back for
+        plans that fail to deploy), so no two workers hand out the same spare
+        capacity.
+        """
+        self.log.info("--- Step 2: Batch remediation for %d congested links ---", len(alarms))
+        with ExitStack() as stack:
+            # 多 worker 协调：跳过其他 worker 正在修复的链路
+            pending, reports = [], []
+            for alarm in alarms:
+                if stack.enter_context(cross_worker_lease(f"chain-{alarm_key(alarm)}")):
+                    pending.append(alarm)
+                else:
+                    reports.append({
+                        "status": "QoS_FIX_IN_PROGRESS",
+                        "message": f"Another repair chain is already remediating {alarm_key(alarm)}.",
+                        "details": {"alarm_id": alarm["alarm_data"].get("alarm_id")}
+                    })
+            if not pending:
+                return reports
+            if "QoS Remediation Agent" not in self.registry:
+                failure = self._handle_chain_failure("QoS Remediation Agent is offline (not discovered)", "Pre-Check")
+                return reports + [failure["final_report"] for _ in pending]
+            alarms_by_link = {(a["source"], a["destination"]): a for a in pending}
+            deployments = []
+            try:
+                # 求解与容量预留在同一把跨 worker 锁内完成：求解前重新加载最新负载，释放锁前写回本批次占用的容量
+                with cross_worker_lock("topology"):
+                    self._reload_topology()
+                    batch_result = self.call_agent_capability(
+                        "QoS Remediation Agent",
+                        "generate_batch_remediation_plans",
+                        topology=self.topology,
+                        congested_links=[{"source": a["source"], "destination": a["destination"]} for a in pending]
+                    )
+                    plans = [RemediationPlan(**plan) for plan in batch_result["remediation_plans"]]
+                    for plan in plans:
+                        alarm = alarms_by_link.pop((plan.device_id, plan.actions.get("destination")), None)
+                        if alarm is None:
+                            # 计划对应的链路不在本批告警中 (或重复)：不部署
+                            self.log.warning("Remediation Plan %s matches no pending alarm, skipped.", plan.plan_id)
+                            continue
+                        self.log.info("Remediation Plan generated: %s", plan.plan_id)
+                        deployments.append((AlarmData(**alarm["alarm_data"]), plan))
+                        apply_reroute(self.topology["links"], plan)
+                    publish_shared_state("topology", self.topology)
+            except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
+                failure = self._handle_chain_failure(e, "QoS Remediation Agent")
+                return reports + [failure["final_report"] for _ in pending]
+
+            # 生成/校验/执行各一次批量 A2A 请求，而不是每个计划各走一遍
+            failed_plans = []
+            for (_, plan), result in zip(deployments, self._deploy_plans(deployments)):
+                reports.append(result["final_report"])
+                if result["final_report"]["status"] != "QoS_FIX_SUCCESS":
+                    failed_plans.append(plan)
+            if failed_plans:
+                # 未部署成功的计划归还预留的容量
+                with cross_worker_lock("topology"):
+                    self._reload_topology()
+                    for plan in failed_plans:
+                        apply_reroute(self.topology["links"], plan, reverse=True)
+                    publish_shared_state("topology", self.topology)
+
+            # 没有得到计划的告警也必须有报告
+            unresolved = set(batch_result.get("unresolved_links", []))
+            for (source, destination), alarm in alarms_by_link.items():
+                link = f"{source}->{destination}"
+                alarm_id = alarm["alarm_data"].get("alarm_id")
+                if link in unresolved:
+                    self.log.warning("No conflict-free reroute found for %s", link)
+                    reports.append(self._handle_chain_failure(f"No conflict-free reroute found for {link}", "QoS Remediation Agent")["final_report"])
+                else:
+                    self.log.info("Link %s is not above target utilization in the topology, no reroute needed.", link)
+                    reports.append({
+                        "status": "QoS_NOT_CONGESTED",
+                        "message": f"Link {link} is not above target utilization in the topology; no reroute was deployed.",
+                        "details": {"alarm_id": alarm_id}
+                    })
+            return reports
+
     def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Executes the QoS repair Chain by calling other agents sequentially."""
+        """Dispatches pushed alarms to the queue; anything else runs the repair Chain synchronously."""
+        if payload.get("capability") == "ingest_alarm":
+            return self._ingest_alarm(payload.get("params", {}))
+        self._sync_registry()
+        with log_context(chain_id=new_id()):
+            return self._run_chain(payload.get("params", {}))
+
+    def _run_chain(self, params: Dict[str, Any], alarm_event: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Executes the QoS repair Chain by calling other agents sequentially.
+        If alarm_event is given (pushed by the Monitor), Step 1 does not poll the Monitor.
+        """
         
         # 1. Trigger QoS Monitor Agent
-        print("\n--- Step 1: Triggering QoS Monitor Agent ---")
-        
-        # 检查是否所有依赖都已发现 (Pre-Check 1)
-        if "QoS Monitor Agent" not in self.known_agents:
-             return self._handle_chain_failure("QoS Monitor Agent is offline (not discovered)", "Pre-Check")
+        if alarm_event is not None:
+            self.log.info("--- Step 1: Alarm pushed by QoS Monitor Agent ---")
+            try:
+                alarm_data = AlarmData(**alarm_event["alarm_data"])
+            except (KeyError, TypeError, ValueError) as e:
+                return self._handle_chain_failure(e, "QoS Monitor Agent")
+            self.log.info("Alarm received: %s (%s)", alarm_data.alarm_id, alarm_data.metric)
+        else:
+            self.log.info("--- Step 1: Triggering QoS Monitor Agent ---")
+            
+            # 检查是否所有依赖都已发现 (Pre-Check 1)
+            if "QoS Monitor Agent" not in self.registry:
+                 return self._handle_chain_failure("QoS Monitor Agent is offline (not discovered)", "Pre-Check")
 
-        try:
-            # FIX: Use model_dump() when calling
-            monitor_result = self.call_agent_capability("QoS Monitor Agent", "monitor_and_alarm", **payload.get('params', {}))
-            alarm_data = AlarmData(**monitor_result["alarm_data"])
-            print(f"Alarm received: {alarm_data.alarm_id} ({alarm_data.metric})")
-        except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
-            return self._handle_chain_failure(e, "QoS Monitor Agent")
+            try:
+                # FIX: Use model_dump() when calling
+                monitor_result = self.call_agent_capability("QoS Monitor Agent", "monitor_and_alarm", **params)
+                alarm_data = AlarmData(**monitor_result["alarm_data"])
+                self.log.info("Alarm received: %s (%s)", alarm_data.alarm_id, alarm_data.metric)
+            except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
+                return self._handle_chain_failure(e, "QoS Monitor Agent")
+
+        # 多 worker 协调：同一条链路同一时刻只允许一个 Chain 进行修复
+        link_key = alarm_key(alarm_event if alarm_event is not None else monitor_result)
+        with cross_worker_lease(f"chain-{link_key}") as acquired:
+            if not acquired:
+                self.log.info("Remediation for %s already in progress, skipping.", link_key)
+                return {"final_report": {
+                    "status": "QoS_FIX_IN_PROGRESS",
+                    "message": f"Another repair chain is already remediating {link_key}.",
+                    "details": {"alarm_id": alarm_data.alarm_id}
+                }}
+            return self._remediate(alarm_data)
+
+    def _remediate(self, alarm_data: AlarmData) -> Dict[str, Any]:
+        """Steps 2-6 of the repair Chain for one alarm."""
 
         # 2. Call QoS Remediation Agent (LangGraph)
-        print("\n--- Step 2: Calling QoS Remediation Agent (Decision Maker) ---")
-        if "QoS Remediation Agent" not in self.known_agents:
+        self.log.info("--- Step 2: Calling QoS Remediation Agent (Decision Maker) ---")
+        if "QoS Remediation Agent" not in self.registry:
              return self._handle_chain_failure("QoS Remediation Agent is offline (not discovered)", "Pre-Check")
              
         try:
@@ -87,96 +382,147 @@ class OrchestrationAgent(OrchestratorBaseAgent):
                 topology=self.topology
             )
             remediation_plan = RemediationPlan(**remediation_result["remediation_plan"])
-            print(f"Remediation Plan generated: {remediation_plan.plan_id}")
+            self.log.info("Remediation Plan generated: %s", remediation_plan.plan_id)
         except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
             return self._handle_chain_failure(e, "QoS Remediation Agent")
 
-        # 3. Call Config Generation Agent (Transformer)
-        print("\n--- Step 3: Calling Config Generation Agent (Transformer) ---")
-        if "Config Generation Agent" not in self.known_agents:
-             return self._handle_chain_failure("Config Generation Agent is offline (not discovered)", "Pre-Check")
+        return self._deploy_plan(alarm_data, remediation_plan)
 
-        try:
-            # FIX: Use model_dump() for structured input
-            generator_result = self.call_agent_capability(
-                "Config Generation Agent",
-                "generate_cli_config",
-                remediation_plan=remediation_plan.model_dump()
-            )
-            cli_config = CLIConfig(**generator_result["cli_config"])
-            print(f"CLI Config generated: {cli_config.cli_text.strip().splitlines()[0]}...")
-        except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
-            return self._handle_chain_failure(e, "Config Generation Agent")
+    def _deploy_plan(self, alarm_data: AlarmData, remediation_plan: RemediationPlan) -> Dict[str, Any]:
+        """Steps 3-6 of the repair Chain: generate, validate and execute the config for one plan."""
+        return self._deploy_plans([(alarm_data, remediation_plan)])[0]
 
-        # 4. Call Config Validation Agent (Quality Control)
-        print("\n--- Step 4: Calling Config Validation Agent (Quality Control) ---")
-        if "Config Validation Agent" not in self.known_agents:
-             return self._handle_chain_failure("Config Validation Agent is offline (not discovered)", "Pre-Check")
+    def _call_step(self, agent_name: str, capability_name: str, params_by_plan: Dict[int, Dict[str, Any]],
+                   reports: List[Any]) -> Dict[int, Dict[str, Any]]:
+        """
+        Runs one Chain step for every plan still in flight: a normal call for
+        a single plan, one batch A2A request for several. Plans that fail get
+        their failure report in `reports`; results of the others are returned.
+        """
+        if agent_name not in self.registry:
+            for i in params_by_plan:
+                reports[i] = self._handle_chain_failure(f"{agent_name} is offline (not discovered)", "Pre-Check")
+            return {}
 
+        indexes = list(params_by_plan)
         try:
-            # FIX: Use model_dump() for structured input
-            validation_result = self.call_agent_capability(
+            if len(indexes) == 1:
+                outcomes = [self.call_agent_capability(agent_name, capability_name, **params_by_plan[indexes[0]])]
+            else:
+                outcomes = self.call_agent_capability_batch(agent_name, capability_name, [params_by_plan[i] for i in indexes])
+        except (ConnectionError, requests.exceptions.HTTPError) as e:
+            outcomes = [e] * len(indexes)
+
+        results = {}
+        for i, outcome in zip(indexes, outcomes):
+            if isinstance(outcome, Exception):
+                reports[i] = self._handle_chain_failure(outcome, agent_name)
+            else:
+                results[i] = outcome
+        return results
+
+    def _deploy_plans(self, deployments: List[Tuple[AlarmData, RemediationPlan]]) -> List[Dict[str, Any]]:
+        """
+        Steps 3-6 of the repair Chain for one or more plans. Each step sends
+        all plans still in flight to its agent together; a plan that fails a
+        step gets its failure report and skips the remaining steps.
+        """
+        reports: List[Any] = [None] * len(deployments)
+
+        # 3. Call Config Generation Agent (Transformer)
+        self.log.info("--- Step 3: Calling Config Generation Agent (Transformer) ---", plans=len(deployments))
+        results = self._call_step(
+            "Config Generation Agent",
+            "generate_cli_config",
+            {i: {"remediation_plan": plan.model_dump()} for i, (_, plan) in enumerate(deployments)},
+            reports
+        )
+        cli_configs: Dict[int, CLIConfig] = {}
+        for i, result in results.items():
+            try:
+                cli_configs[i] = CLIConfig(**result["cli_config"])
+                self.log.info("CLI Config generated: %s...", cli_configs[i].cli_text.strip().split("\n", 1)[0])
+            except KeyError as e:
+                reports[i] = self._handle_chain_failure(e, "Config Generation Agent")
+
+        # 4. Call Config Validation Agent (Quality Control)
+        if cli_configs:
+            self.log.info("--- Step 4: Calling Config Validation Agent (Quality Control) ---", plans=len(cli_configs))
+            results = self._call_step(
                 "Config Validation Agent",
                 "validate_config",
-                cli_config=cli_config.model_dump()
+                # 携带计划优先级，供下游 Agent 的准入控制排序
+                {i: {"cli_config": cli_config.model_dump(), "priority": deployments[i][1].priority} for i, cli_config in cli_configs.items()},
+                reports
             )
-            validation = ValidationResult(**validation_result["validation_result"])
-            print(f"Config Validation Result: {validation.is_valid}")
-            
-            if not validation.is_valid:
-                return self._handle_chain_failure(f"Validation Failed: {validation.report}", "Config Validation Agent")
-
-        except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
-            return self._handle_chain_failure(e, "Config Validation Agent")
+            for i, result in results.items():
+                try:
+                    validation = ValidationResult(**result["validation_result"])
+                except KeyError as e:
+                    reports[i] = self._handle_chain_failure(e, "Config Validation Agent")
+                    continue
+                self.log.info("Config Validation Result: %s", validation.is_valid)
+                if not validation.is_valid:
+                    reports[i] = self._handle_chain_failure(f"Validation Failed: {validation.report}", "Config Validation Agent")
 
         # 5. Call Config Execution Agent (Executor)
-        print("\n--- Step 5: Calling Config Execution Agent (Executor) ---")
-        if "Config Execution Agent" not in self.known_agents:
-             return self._handle_chain_failure("Config Execution Agent is offline (not discovered)", "Pre-Check")
-
-        try:
-            # FIX: Use model_dump() for structured input
-            executor_result = self.call_agent_capability(
+        validated = {i: cli_config for i, cli_config in cli_configs.items() if reports[i] is None}
+        if validated:
+            self.log.info("--- Step 5: Calling Config Execution Agent (Executor) ---", plans=len(validated))
+            results = self._call_step(
                 "Config Execution Agent",
                 "execute_config",
-                cli_config=cli_config.model_dump()
+                {i: {"cli_config": cli_config.model_dump(), "device_id": deployments[i][1].device_id, "priority": deployments[i][1].priority}
+                 for i, cli_config in validated.items()},
+                reports
             )
-            execution_status = ExecutionStatus(**executor_result["execution_status"])
-            print(f"Config Execution Status: {execution_status.status}")
+            for i, result in results.items():
+                try:
+                    execution_status = ExecutionStatus(**result["execution_status"])
+                except KeyError as e:
+                    reports[i] = self._handle_chain_failure(e, "Config Execution Agent")
+                    continue
+                self.log.info("Config Execution Status: %s", execution_status.status)
 
-        except (ConnectionError, requests.exceptions.HTTPError, KeyError) as e:
-            return self._handle_chain_failure(e, "Config Execution Agent")
-        
-        # 6. Reporting (Aggregated by Orchestrator)
-        final_report = {
-            "status": "QoS_FIX_SUCCESS",
-            "message": f"QoS repair chain completed successfully. Execution status: {execution_status.status}.",
-            "details": {
-                "alarm_id": alarm_data.alarm_id,
-                "plan_id": remediation_plan.plan_id,
-                "deployed_config": cli_config.cli_text
-            }
-        }
-        print("\n--- Step 6: Final Report Generated ---")
-        print(json.dumps(final_report, indent=2))
-        return {"final_report": final_report}
+                # 6. Reporting (Aggregated by Orchestrator)
+                alarm_data, remediation_plan = deployments[i]
+                final_report = {
+                    "status": "QoS_FIX_SUCCESS",
+                    "message": f"QoS repair chain completed successfully. Execution status: {execution_status.status}.",
+                    "details": {
+                        "alarm_id": alarm_data.alarm_id,
+                        "plan_id": remediation_plan.plan_id,
+                        "deployed_config": validated[i].cli_text
+                    }
+                }
+                # 报告作为结构化字段交给后台写出线程，序列化不在 Chain 的关键路径上
+                self.log.info("--- Step 6: Final Report Generated ---", final_report=final_report)
+                reports[i] = {"final_report": final_report}
+
+        return reports
 
     def _handle_chain_failure(self, error: Any, failed_agent: str) -> Dict[str, Any]:
         """Handles chain failure, aborts subsequent steps, and returns a failure report."""
-        print(f"\n--- CHAIN ABORTED ---")
-        print(f"Failure at {failed_agent}: {error}")
+        self.log.error("--- CHAIN ABORTED --- Failure at %s: %s", failed_agent, error)
         
         failure_report = {
             "status": "QoS_FIX_FAILURE",
             "message": f"QoS repair chain failed at {failed_agent}. Error: {str(error)}",
             "failed_step": failed_agent
         }
+        circuit_state = self.registry.agent_state(failed_agent)
+        if circuit_state is not None:
+            failure_report["circuit_state"] = circuit_state
+        if isinstance(error, OverloadedError):
+            # 对方过载而非故障：调用方可在 retry_after 秒后重试
+            failure_report["retriable"] = True
+            failure_report["retry_after"] = error.retry_after
         return {"final_report": failure_report}
 
 
-card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"])
+card = generate_agent_card(AGENT_NAME, CONFIG["port"], CONFIG["description"], CONFIG["capability"], CONFIG["params"], CONFIG["returns"], CONFIG.get("extra_capabilities"))
 agent = OrchestrationAgent(AGENT_NAME, "localhost", CONFIG["port"], card)
 
 if __name__ == "__main__":
     print(f"Starting {AGENT_NAME} on port {CONFIG['port']}...")
-    uvicorn.run(agent.app, host=agent.host, port=agent.port)
\ No newline at end of file
+    serve(f"{__spec__.name}:agent.app", agent.app, agent.host, agent.port, prepare=agent.prepare_shared_state)
\ No newline at end of file
@@ -1,9 +1,19 @@
 from abc import ABC, abstractmethod
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from models.a2a_models import AgentCard, A2AMessage
-from typing import Dict, Any
+from .resilience import CallTimeoutError, CircuitBreaker, LatencyTracker, OverloadedError
+from .admission import AdmissionController, request_priority, overloaded_response
+from .cassette import replayable
+from .agent_registry import AgentRegistry, Replica, RegistrationHeartbeat
+from .agent_logging import get_logger, log_context, current_trace_id, new_id
+from .serving import worker_lifespan
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from typing import Dict, Any, List, Set, Union
+import contextvars
 import requests
 import json
+import os
+import threading
 import time
 
 class ADKA2ABaseAgent(ABC):
@@ -11,20 +21,58 @@ class ADKA2ABaseAgent(ABC):
     Simulates the core functionalities of an ADK Dedicated Class and A2A server.
     All ADK agents (1, 3, 4, 5, 6) inherit from this.
     """
+
+    # 启动时向 ORCHESTRATOR_URL 注册本副本 (编排者自身不注册)
+    self_register = True
+    # 单个批量请求允许的最大消息数
+    MAX_BATCH_SIZE = int(os.getenv("A2A_MAX_BATCH_SIZE", "64"))
+    # 不经过准入控制的能力 (必须足够轻量，例如只入队的操作)
+    admission_exempt: Set[str] = set()
     
     def __init__(self, agent_name: str, host: str, port: int, card: AgentCard):
         self.agent_name = agent_name
         self.host = host
         self.port = port
         self.card = card
-        self.app = FastAPI(title=f"{agent_name} A2A Server")
+        self.log = get_logger(agent_name)
+        # Per-worker initialization (clients, background threads) runs at server startup;
+        # replicas also keep themselves registered with the Orchestrator (only if ORCHESTRATOR_URL is set)
+        on_startup, on_shutdown = [self.on_worker_start], []
+        if self.self_register:
+            heartbeat = RegistrationHeartbeat(card)
+            on_startup.append(heartbeat.start)
+            on_shutdown.append(heartbeat.stop)
+        self.app = FastAPI(title=f"{agent_name} A2A Server", lifespan=worker_lifespan(on_startup, on_shutdown))
         
         # Setup A2A endpoint
         self.app.add_api_route("/a2a", self.handle_a2a_message, methods=["POST"])
+        # Batch A2A endpoint: many messages in one round trip
+        self.app.add_api_route("/a2a/batch", self.handle_a2a_batch, methods=["POST"])
+        self.batch_concurrency = int(os.getenv("A2A_BATCH_CONCURRENCY", "8"))
+        self._batch_pool = ThreadPoolExecutor(max_workers=self.batch_concurrency, thread_name_prefix="a2a-batch")
         # Setup Agent Card endpoint
         self.app.add_api_route("/.well-known/agent.json", self.get_agent_card, methods=["GET"])
+        # Admission control: bounded, priority-ordered queue in front of process_message
+        self.admission = AdmissionController(
+            agent_name,
+            max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+        )
+        self.app.add_api_route("/admission", self.admission.stats, methods=["GET"])
         
-        print(f"[{agent_name}] Initialized at {self.card.endpoint}")
+        self.log.info("Initialized at %s", self.card.endpoint)
+
+    def prepare_shared_state(self):
+        """
+        Pre-fork hook, run once in the parent process before workers start.
+        Subclasses publish read-only data (see serving.publish_shared_state) here.
+        Construction must stay cheap: every worker re-imports the agent module.
+        """
+        pass
+
+    def on_worker_start(self):
+        """Per-worker hook: build clients and start background threads owned by this worker."""
+        pass
 
     def get_agent_card(self) -> AgentCard:
         """Exposes the Agent Card for discovery"""
@@ -35,44 +83,177 @@ class ADKA2ABaseAgent(ABC):
         """Core business logic for the agent, must be implemented by subclasses."""
         pass
 
-    def handle_a2a_message(self, message: A2AMessage) -> Dict[str, Any]:
-        """Handles incoming A2A messages from the network."""
-        capability_name = message.payload.get('capability', 'default')
-        print(f"[{self.agent_name}] Received message from {message.sender_id} to execute {capability_name}")
+    def process_batch(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Processes several payloads and returns one A2A response per payload,
+        in order ({"status": "success", "result": ...} or {"status": "failure",
+        "error": ...}). The default fans process_message out concurrently;
+        subclasses override it to amortize work across the batch (e.g. one
+        LLM call for all items). At most batch_slots(len(payloads)) items run
+        at once, matching the admission slots the batch holds.
+        """
+        limit = threading.BoundedSemaphore(self.batch_slots(len(payloads)))
+
+        def respond(payload: Dict[str, Any]) -> Dict[str, Any]:
+            with limit:
+                return self._respond(payload)
+
+        futures = [self._batch_pool.submit(contextvars.copy_context().run, respond, payload) for payload in payloads]
+        return [future.result() for future in futures]
+
+    def batch_slots(self, size: int) -> int:
+        """Admission slots charged for a batch of `size` messages: how many of them may run in parallel."""
+        return max(min(size, self.batch_concurrency, self.admission.max_concurrency), 1)
+
+    def _respond(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Runs process_message for one payload and wraps the outcome as an A2A response."""
         try:
-            result = self.process_message(message.payload)
-            return {"status": "success", "result": result}
+            return {"status": "success", "result": self.process_message(payload)}
         except Exception as e:
-            print(f"[{self.agent_name}] Error processing message: {e}")
+            self.log.error("Error processing message: %s", e, capability=payload.get('capability', 'default'))
             return {"status": "failure", "error": str(e)}
 
-    def send_a2a_message(self, receiver_card: AgentCard, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def handle_a2a_message(self, message: A2AMessage) -> Dict[str, Any]:
+        """
+        Handles incoming A2A messages from the network.
+        Requests pass admission control first: when the agent is saturated
+        they queue by priority, and are answered with a retriable
+        "overloaded" response if they cannot be served before their deadline.
+        """
+        capability_name = message.payload.get('capability', 'default')
+        with log_context(trace_id=message.trace_id or new_id()):
+            self.log.info("Received message from %s to execute %s", message.sender_id, capability_name)
+            if capability_name in self.admission_exempt:
+                return self._respond(message.payload)
+            priority = request_priority(message.payload)
+            try:
+                with self.admission.admit(priority, message.deadline) as ticket:
+                    response = self._respond(message.payload)
+            except OverloadedError as e:
+                self.log.warning("Shed %s: %s", capability_name, e, priority=priority)
+                return overloaded_response(e)
+            # 排队时间与服务时间分开上报
+            response["timing"] = ticket.timing()
+            self.log.info("Served %s", capability_name, priority=priority, **ticket.timing())
+            return response
+
+    def handle_a2a_batch(self, messages: List[A2AMessage]) -> List[Dict[str, Any]]:
+        """Handles a list of A2A messages; responses are returned in the same order."""
+        if len(messages) > self.MAX_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"Batch of {len(messages)} messages exceeds limit of {self.MAX_BATCH_SIZE}.")
+        if not messages:
+            return []
+        # 一个批次通常来自同一条 Chain，沿用第一条消息的 trace_id
+        with log_context(trace_id=messages[0].trace_id or new_id()):
+            self.log.info("Received batch of %d messages from %s", len(messages), messages[0].sender_id,
+                          capabilities=sorted({m.payload.get('capability', 'default') for m in messages}))
+            # 整个批次作为一个请求准入：取最紧急的优先级和最早的截止时间；
+            # 批次内最多并行 batch_slots 条，按此占用槽位，保证 ADMISSION_MAX_CONCURRENCY 对批量请求同样是真实上限
+            priority = min(request_priority(m.payload) for m in messages)
+            deadlines = [m.deadline for m in messages if m.deadline is not None]
+            try:
+                with self.admission.admit(priority, min(deadlines) if deadlines else None, slots=self.batch_slots(len(messages))) as ticket:
+                    responses = self.process_batch([m.payload for m in messages])
+            except OverloadedError as e:
+                self.log.warning("Shed batch of %d messages: %s", len(messages), e, priority=priority)
+                return [overloaded_response(e) for _ in messages]
+            for response in responses:
+                response["timing"] = ticket.timing()
+            self.log.info("Served batch of %d messages", len(messages), priority=priority, **ticket.timing())
+            return responses
+
+    def send_a2a_message(self, receiver_card: AgentCard, payload: Dict[str, Any], timeout: float = 60) -> Dict[str, Any]:
         """Sends an A2A message to another Agent."""
         message = A2AMessage(
             sender_id=self.agent_name,
             receiver_id=receiver_card.name,
-            payload=payload
+            payload=payload,
+            trace_id=current_trace_id(),
+            deadline=time.time() + timeout
         )
-        print(f"[{self.agent_name}] Sending message to {receiver_card.name} at {receiver_card.endpoint}")
+        self.log.debug("Sending message to %s at %s", receiver_card.name, receiver_card.endpoint, capability=payload.get("capability"))
+        # 录制/回放 (CASSETTE_MODE)：按接收方 + payload 匹配，trace_id / deadline 不参与
+        return replayable("a2a", receiver_card.name, payload,
+                          lambda: self._post_a2a(receiver_card, receiver_card.endpoint, message.dict(), timeout))
+
+    def _post_a2a(self, receiver_card: AgentCard, url: str, body: Any, timeout: float) -> Any:
         try:
-            response = requests.post(receiver_card.endpoint, json=message.dict(), timeout=60)
+            # (connect, read) 超时：连接失败应在几秒内暴露
+            response = requests.post(url, json=body, timeout=(min(3.0, timeout), timeout))
             response.raise_for_status()
             return response.json()
+        except requests.exceptions.ReadTimeout as e:
+            self.log.warning("A2A message to %s timed out after %.1fs", receiver_card.name, timeout)
+            raise CallTimeoutError(f"A2A communication with {receiver_card.name} timed out after {timeout:.1f}s: {e}")
         except requests.exceptions.RequestException as e:
             # Propagate communication failure up the chain
-            print(f"[{self.agent_name}] Failed to send A2A message to {receiver_card.name}: {e}")
+            self.log.warning("Failed to send A2A message to %s: %s", receiver_card.name, e)
             raise ConnectionError(f"A2A communication failed with {receiver_card.name}: {e}")
 
+    def send_a2a_batch(self, receiver_card: AgentCard, payloads: List[Dict[str, Any]], timeout: float = 60) -> List[Dict[str, Any]]:
+        """Sends several A2A messages to another Agent in one request (POST <endpoint>/batch)."""
+        deadline = time.time() + timeout
+        messages = [
+            A2AMessage(sender_id=self.agent_name, receiver_id=receiver_card.name, payload=payload,
+                       trace_id=current_trace_id(), deadline=deadline).dict()
+            for payload in payloads
+        ]
+        self.log.debug("Sending batch of %d messages to %s at %s", len(messages), receiver_card.name, receiver_card.endpoint)
+        responses = replayable("a2a_batch", receiver_card.name, payloads,
+                               lambda: self._post_a2a(receiver_card, f"{receiver_card.endpoint}/batch", messages, timeout))
+        if len(responses) != len(messages):
+            raise ConnectionError(f"A2A batch to {receiver_card.name} returned {len(responses)} responses for {len(messages)} messages")
+        return responses
+
 # Orchestrator's specific base class
 class OrchestratorBaseAgent(ADKA2ABaseAgent):
     """
     Simulates ADK Orchestration Class with robust discovery.
     Note: call_agent_capability is implemented here, accessible to the OrchestrationAgent subclass.
+    Agents may run as several replicas: `registry` holds every card per agent
+    name and each call goes to the healthy replica with the fewest
+    outstanding requests. Replicas can (de)register themselves at runtime via
+    /registry/register and /registry/deregister. Each agent gets a latency
+    tracker (timeouts follow observed p99, timed-out calls included) and each
+    replica a circuit breaker (fail fast while it is unhealthy; the half-open
+    trial call uses DEFAULT_TIMEOUT). Capabilities listed in
+    `hedged_capabilities` are idempotent and may be sent again, to another
+    replica when available, once the first attempt is slower than the p95.
     """
+
+    # 超时策略：未积累足够样本前使用默认值，之后为 2 * p99，限制在 [floor, ceiling] 内
+    DEFAULT_TIMEOUT = 60.0
+    TIMEOUT_FLOOR = 2.0
+    TIMEOUT_CEILING = 60.0
+    self_register = False
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.known_agents: Dict[str, AgentCard] = {}
+        self.registry = AgentRegistry()
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.hedged_capabilities: Set[str] = set()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="a2a-hedge")
+        self.app.add_api_route("/registry/register", self.register_replica, methods=["POST"])
+        self.app.add_api_route("/registry/deregister", self.deregister_replica, methods=["POST"])
+
+    def register_replica(self, card: AgentCard) -> Dict[str, Any]:
+        """Dynamic registration of an agent replica (called by the replica at startup)."""
+        self.registry.register(card)
+        self.log.info("Registered replica of %s at %s", card.name, card.endpoint, replicas=len(self.registry.cards(card.name)))
+        return {"status": "registered", "replicas": len(self.registry.cards(card.name))}
+
+    def deregister_replica(self, card: AgentCard) -> Dict[str, Any]:
+        """Removes a replica (called by the replica at shutdown)."""
+        removed = self.registry.deregister(card.name, card.endpoint)
+        self.log.info("Deregistered replica of %s at %s", card.name, card.endpoint, removed=removed)
+        return {"status": "deregistered" if removed else "unknown", "replicas": len(self.registry.cards(card.name))}
+
+    def _tracker(self, agent_name: str) -> LatencyTracker:
+        return self.latency.setdefault(agent_name, LatencyTracker())
+
+    def agent_timeout(self, agent_name: str) -> float:
+        """Current adaptive timeout (seconds) for calls to agent_name."""
+        return self._tracker(agent_name).timeout(self.DEFAULT_TIMEOUT, self.TIMEOUT_FLOOR, self.TIMEOUT_CEILING)
     
     def discover_agent(self, agent_card_url: str, max_retries: int = 7, delay: float = 1.5) -> AgentCard:
         """
@@ -81,45 +262,140 @@ class OrchestratorBaseAgent(ADKA2ABaseAgent):
         """
         for attempt in range(max_retries):
             try:
-                print(f"[Orchestrator] Discovering Agent Card at {agent_card_url} (Attempt {attempt + 1}/{max_retries})")
-                response = requests.get(agent_card_url, timeout=3)
-                response.raise_for_status()
-                
-                card = AgentCard(**response.json())
-                self.known_agents[card.name] = card
-                print(f"[Orchestrator] Successfully discovered {card.name}")
+                self.log.info("Discovering Agent Card at %s (Attempt %d/%d)", agent_card_url, attempt + 1, max_retries)
+                card = AgentCard(**replayable("agent_card", agent_card_url, None, lambda: self._fetch_card(agent_card_url)))
+                self.registry.register(card)
+                self.log.info("Successfully discovered %s", card.name)
                 return card
             
-            except requests.exceptions.RequestException as e:
+            except ConnectionError as e:
                 if attempt < max_retries - 1:
                     time.sleep(delay)
                 else:
                     raise ConnectionError(f"Failed to discover agent at {agent_card_url} after {max_retries} attempts. Error: {e}")
 
+    @staticmethod
+    def _fetch_card(agent_card_url: str) -> Dict[str, Any]:
+        try:
+            response = requests.get(agent_card_url, timeout=3)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise ConnectionError(str(e))
+
     def call_agent_capability(self, agent_name: str, capability_name: str, **kwargs) -> Dict[str, Any]:
         """
         Calls a specific capability on a discovered agent.
         This is the method used by the Orchestrator's Chain logic.
         """
-        if agent_name not in self.known_agents:
-            raise ValueError(f"Agent {agent_name} not discovered. Cannot call capability.")
-        
-        target_card = self.known_agents[agent_name]
-        
         # Payload structure for A2A capability call
         payload = {
             "capability": capability_name,
             "params": kwargs
         }
         
-        # This calls the inherited send_a2a_message
-        response = self.send_a2a_message(target_card, payload)
+        # 选择负载最低的健康副本；全部熔断时抛出 CircuitOpenError (ConnectionError 子类，由 Chain 统一处理)
+        replica = self.registry.acquire(agent_name)
+
+        # 半开试探调用使用默认超时：若沿用自适应超时，延迟上升后的试探会以同样的方式超时，熔断永远无法恢复
+        if replica.breaker.state == CircuitBreaker.HALF_OPEN:
+            timeout = self.DEFAULT_TIMEOUT
+        else:
+            timeout = self.agent_timeout(agent_name)
+        started = time.monotonic()
+        try:
+            if capability_name in self.hedged_capabilities:
+                response = self._send_hedged(agent_name, replica, payload, timeout)
+            else:
+                response = self._send_to_replica(replica, payload, timeout)
+        except CallTimeoutError:
+            # 超时的调用同样计入样本 (不小于超时值)，使自适应超时能随延迟上升而增大
+            self._tracker(agent_name).record(max(time.monotonic() - started, timeout))
+            raise
+        self._tracker(agent_name).record(time.monotonic() - started)
         
         if response.get("status") == "success":
             return response.get("result", {})
+        elif response.get("status") == "overloaded":
+            # 对方准入控制拒绝了请求：可重试，不计为副本故障
+            raise OverloadedError(f"Remote agent {agent_name} shed the request: {response.get('error')}", retry_after=response.get("retry_after"))
         else:
             # Raise an HTTPError if the remote agent failed internally
             raise requests.exceptions.HTTPError(
                 f"Remote agent {agent_name} failed execution: {response.get('error', 'Unknown remote error')}",
                 response=requests.Response() # Use a placeholder response object
-            )
\ No newline at end of file
+            )
+
+    def call_agent_capability_batch(self, agent_name: str, capability_name: str, params_list: List[Dict[str, Any]]) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Calls the same capability for many inputs in one A2A round trip.
+        Returns, in order, the result dict of each call or the exception for
+        the calls that failed remotely. Failing to reach the agent at all
+        raises ConnectionError, as in call_agent_capability.
+        """
+        payloads = [{"capability": capability_name, "params": params} for params in params_list]
+        responses: List[Dict[str, Any]] = []
+        # 超过接收方上限的批次按 MAX_BATCH_SIZE 分块发送
+        for start in range(0, len(payloads), self.MAX_BATCH_SIZE):
+            replica = self.registry.acquire(agent_name)
+            # 批量请求的耗时不代表单次调用，使用默认超时且不计入延迟统计
+            responses.extend(self._send_to_replica(replica, payloads[start:start + self.MAX_BATCH_SIZE], self.DEFAULT_TIMEOUT, batch=True))
+
+        results: List[Union[Dict[str, Any], Exception]] = []
+        for response in responses:
+            if response.get("status") == "success":
+                results.append(response.get("result", {}))
+            elif response.get("status") == "overloaded":
+                results.append(OverloadedError(f"Remote agent {agent_name} shed the request: {response.get('error')}", retry_after=response.get("retry_after")))
+            else:
+                results.append(requests.exceptions.HTTPError(
+                    f"Remote agent {agent_name} failed execution: {response.get('error', 'Unknown remote error')}",
+                    response=requests.Response()
+                ))
+        return results
+
+    def _send_to_replica(self, replica: Replica, payload: Union[Dict[str, Any], List[Dict[str, Any]]], timeout: float, batch: bool = False) -> Any:
+        """Sends to an acquired replica, updates its breaker and releases it."""
+        try:
+            # This calls the inherited send_a2a_message (or send_a2a_batch for a list of payloads)
+            if batch:
+                response = self.send_a2a_batch(replica.card, payload, timeout=timeout)
+            else:
+                response = self.send_a2a_message(replica.card, payload, timeout=timeout)
+        except ConnectionError:
+            replica.breaker.record_failure()
+            raise
+        finally:
+            self.registry.release(replica)
+        replica.breaker.record_success()
+        return response
+
+    def _send_hedged(self, agent_name: str, replica: Replica, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """
+        Sends the request and, if no answer arrives within the agent's p95
+        latency, sends a second copy (to another replica if there is one);
+        the first successful response wins. Only used for idempotent capabilities.
+        """
+        hedge_delay = self._tracker(agent_name).percentile(95)
+        # 复制当前上下文，让对冲线程中的日志保留 chain_id / trace_id
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._send_to_replica, replica, payload, timeout)
+        if hedge_delay is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        try:
+            hedge_replica = self.registry.acquire(agent_name, exclude=replica)
+        except ConnectionError:
+            return primary.result()
+        self.log.info("Hedging request to %s after %.2fs", agent_name, hedge_delay, endpoint=hedge_replica.card.endpoint)
+        hedge = self._hedge_pool.submit(contextvars.copy_context().run, self._send_to_replica, hedge_replica, payload, timeout)
+        last_error = None
+        for future in as_completed([primary, hedge]):
+            try:
+                return future.result()
+            except ConnectionError as e:
+                last_error = e
+        raise last_error
@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .resilience import LatencyTracker, OverloadedError
+
+# 优先级数值越小越紧急 (与 RemediationPlan.priority 一致，1 为最高)；未携带优先级的请求取中间值
+DEFAULT_PRIORITY = 5
+
+
+def request_priority(payload: Dict[str, Any]) -> int:
+    """
+    Priority of an A2A payload: payload["priority"], then params["priority"],
+    then params["remediation_plan"]["priority"], else DEFAULT_PRIORITY.
+    """
+    params = payload.get("params") or {}
+    plan = params.get("remediation_plan") or {}
+    for value in (payload.get("priority"), params.get("priority"), plan.get("priority") if isinstance(plan, dict) else None):
+        if isinstance(value, (int, float)):
+            return int(value)
+    return DEFAULT_PRIORITY
+
+
+class AdmissionTicket:
+    """Timing of one admitted request: time spent queued vs. time spent being served."""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.queue_seconds = 0.0
+        self.service_seconds = 0.0
+
+    def timing(self) -> Dict[str, float]:
+        return {"queue_ms": round(self.queue_seconds * 1000, 1), "service_ms": round(self.service_seconds * 1000, 1)}
+
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "slots", "event", "shed_reason")
+
+    def __init__(self, priority: int, deadline: Optional[float], slots: int):
+        self.priority = priority
+        self.deadline = deadline
+        self.slots = slots
+        self.event = threading.Event()
+        self.shed_reason: Optional[str] = None
+
+
+class AdmissionController:
+    """
+    Bounded, priority-ordered admission for the requests of one agent.
+    At most `max_concurrency` slots are in use at once (a request takes one
+    slot, a batch one per item it may run in parallel) and up to `max_queue`
+    more requests wait, most urgent (lowest priority value) first, FIFO
+    within a priority; a waiter needing several slots is not overtaken by
+    less urgent ones. A request is shed with OverloadedError when:
+    - the queue is full and it is not more urgent than the least urgent
+      waiter (otherwise that waiter is shed to make room);
+    - its deadline cannot be met given the backlog ahead of it and the
+      observed service time;
+    - its deadline passes while it is still queued.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 4, max_queue: int = 32):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._heap: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._service_ewma: Optional[float] = None
+        self.queue_wait = LatencyTracker(window=500, min_samples=1)
+        self.service_time = LatencyTracker(window=500, min_samples=1)
+        self._counters = {"admitted": 0, "enqueued": 0, "shed_queue_full": 0, "shed_deadline": 0, "evicted": 0}
+
+    def _retry_after(self) -> float:
+        # 预计排空当前积压所需的时间，作为调用方的退避建议
+        service = self._service_ewma or 1.0
+        return round(service * (len(self._heap) / self.max_concurrency + 1), 2)
+
+    def _shed(self, counter: str, reason: str) -> OverloadedError:
+        self._counters[counter] += 1
+        return OverloadedError(f"{self.name} overloaded: {reason}", retry_after=self._retry_after())
+
+    def _acquire(self, priority: int, deadline: Optional[float], slots: int):
+        with self._lock:
+            if self._active + slots <= self.max_concurrency and not self._heap:
+                self._active += slots
+                self._counters["admitted"] += 1
+                return
+
+            if deadline is not None and self._service_ewma is not None:
+                # 排在前面的请求 (同级或更紧急) 需要多少轮服务，加上自身的服务时间
+                ahead = sum(1 for p, _, _ in self._heap if p <= priority)
+                expected = (ahead // self.max_concurrency + 2) * self._service_ewma
+                if time.time() + expected > deadline:
+                    raise self._shed("shed_deadline", f"deadline cannot be met ({ahead} requests ahead)")
+
+            if len(self._heap) >= self.max_queue:
+                worst = max(self._heap)
+                if worst[0] <= priority:
+                    raise self._shed("shed_queue_full", f"queue full ({self.max_queue} waiting)")
+                # 新请求更紧急：挤掉队列中最不紧急 (且最晚到达) 的请求
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+                worst[2].shed_reason = "evicted by a more urgent request"
+                worst[2].event.set()
+
+            waiter = _Waiter(priority, deadline, slots)
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self._counters["enqueued"] += 1
+            # 若它排到了队首且空闲槽位足够 (队首的大批次正在等待更多槽位)，立即放行
+            self._grant()
+
+        timeout = None if deadline is None else max(deadline - time.time(), 0.0)
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if not waiter.event.is_set():
+                self._heap = [entry for entry in self._heap if entry[2] is not waiter]
+                heapq.heapify(self._heap)
+                waiter.shed_reason = "deadline expired while queued"
+                # 离开队首的可能是一个大批次：后面的请求也许已经可以放行
+                self._grant()
+            if waiter.shed_reason is not None:
+                counter = "evicted" if waiter.shed_reason.startswith("evicted") else "shed_deadline"
+                raise self._shed(counter, waiter.shed_reason)
+            # 槽位已由 release() 直接转交给本请求
+            self._counters["admitted"] += 1
+
+    def _grant(self):
+        """Hands free slots to the queue head(s), in priority order (caller holds the lock)."""
+        now = time.time()
+        while self._heap:
+            _, _, waiter = self._heap[0]
+            if waiter.deadline is not None and now >= waiter.deadline:
+                heapq.heappop(self._heap)
+                waiter.shed_reason = "deadline expired while queued"
+                waiter.event.set()
+                continue
+            if self._active + waiter.slots > self.max_concurrency:
+                return
+            heapq.heappop(self._heap)
+            self._active += waiter.slots
+            waiter.event.set()
+
+    def _release(self, service_seconds: float, slots: int):
+        with self._lock:
+            self._service_ewma = service_seconds if self._service_ewma is None else 0.8 * self._service_ewma + 0.2 * service_seconds
+            self._active -= slots
+            self._grant()
+
+    @contextmanager
+    def admit(self, priority: int = DEFAULT_PRIORITY, deadline: Optional[float] = None, slots: int = 1) -> Iterator[AdmissionTicket]:
+        """
+        Waits for `slots` serving slots (raises OverloadedError if the request is shed).
+        deadline is an absolute time.time() after which the caller stops waiting.
+        """
+        slots = min(max(slots, 1), self.max_concurrency)
+        ticket = AdmissionTicket(priority)
+        queued_at = time.monotonic()
+        self._acquire(priority, deadline, slots)
+        ticket.queue_seconds = time.monotonic() - queued_at
+        self.queue_wait.record(ticket.queue_seconds)
+        started = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            ticket.service_seconds = time.monotonic() - started
+            self.service_time.record(ticket.service_seconds)
+            self._release(ticket.service_seconds, slots)
+
+    def stats(self) -> Dict[str, Any]:
+        """Load, counters and queue-wait / service-time percentiles (ms), exposed as metrics."""
+        def ms(tracker: LatencyTracker, pct: float) -> Optional[float]:
+            value = tracker.percentile(pct)
+            return None if value is None else round(value * 1000, 1)
+
+        with self._lock:
+            load = {"active": self._active, "queued": len(self._heap), "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+            counters = dict(self._counters)
+        return {
+            **load,
+            **counters,
+            "queue_wait_ms": {"p50": ms(self.queue_wait, 50), "p95": ms(self.queue_wait, 95)},
+            "service_ms": {"p50": ms(self.service_time, 50), "p95": ms(self.service_time, 95)},
+        }
+
+
+def overloaded_response(error: OverloadedError) -> Dict[str, Any]:
+    """A2A response for a shed request: the caller may retry after `retry_after` seconds."""
+    return {"status": "overloaded", "error": str(error), "retriable": True, "retry_after": error.retry_after}
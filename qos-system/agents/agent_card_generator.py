@@ -1,3 +1,4 @@
+import os
 from models.a2a_models import AgentCard, Capability, CapabilityParameter
 from typing import Dict
 
@@ -10,7 +11,24 @@ AGENT_CONFIGS: Dict[str, Dict] = {
         "description": "触发器：持续监控时序DB，QoS劣化时发送结构化告警。",
         "capability": "monitor_and_alarm",
         "params": {},
-        "returns": {"alarm_data": CapabilityParameter(description="结构化告警数据")}
+        "returns": {"alarm_data": CapabilityParameter(description="结构化告警数据")},
+        "extra_capabilities": {
+            "query_telemetry": {
+                "description": "历史查询：从内嵌的链路时序库查询某条链路的趋势 (range) 或区间内最拥塞的 N 条链路 (top_congested)。",
+                "params": {
+                    "query": CapabilityParameter(description="range 或 top_congested"),
+                    "link": CapabilityParameter(description="链路，例如 Router-A->Router-B (range 必填)"),
+                    "metric": CapabilityParameter(description="utilization (默认) / load_mbps / latency_ms"),
+                    "start": CapabilityParameter(type="number", description="起始时间 (epoch 秒)，默认 end - window_s"),
+                    "end": CapabilityParameter(type="number", description="结束时间 (epoch 秒)，默认当前时间"),
+                    "window_s": CapabilityParameter(type="number", description="未给出 start 时的时间窗口 (秒)，默认 3600"),
+                    "resolution": CapabilityParameter(description="raw / 1m / 1h / 1d，默认按时间跨度自动选择"),
+                    "n": CapabilityParameter(type="number", description="top_congested 返回的链路数，默认 5"),
+                    "stat": CapabilityParameter(description="top_congested 排序依据：p95 (默认) / mean / max / min")
+                },
+                "returns": {"telemetry": CapabilityParameter(type="object", description="时间序列点或链路排行")}
+            }
+        }
     },
     # ----------------------------------------------------
     # 2. QoS Remediation Agent (LangGraph) - Port: 8002
@@ -23,7 +41,17 @@ AGENT_CONFIGS: Dict[str, Dict] = {
             "alarm_data": CapabilityParameter(description="结构化告警数据"),
             "topology": CapabilityParameter(description="网络拓扑信息")
         },
-        "returns": {"remediation_plan": CapabilityParameter(description="高层 JSON 修复方案")}
+        "returns": {"remediation_plan": CapabilityParameter(description="高层 JSON 修复方案")},
+        "extra_capabilities": {
+            "generate_batch_remediation_plans": {
+                "description": "批量决策：对多条同时拥塞的链路联合求解重路由 (共享剩余容量)，输出一组互不冲突的修复方案。",
+                "params": {
+                    "topology": CapabilityParameter(type="object", description="网络拓扑信息 (含 links 的容量/负载)"),
+                    "congested_links": CapabilityParameter(type="object", description="需处理的拥塞链路 [{source, destination}]，为空则处理全部")
+                },
+                "returns": {"remediation_plans": CapabilityParameter(type="object", description="修复方案列表")}
+            }
+        }
     },
     # ----------------------------------------------------
     # 3. Config Generation Agent (ADK) - Port: 8003
@@ -52,7 +80,10 @@ AGENT_CONFIGS: Dict[str, Dict] = {
         "port": 8005,
         "description": "实施者：通过 MCP 接口部署配置。",
         "capability": "execute_config",
-        "params": {"cli_config": CapabilityParameter(description="CLI 配置文本")},
+        "params": {
+            "cli_config": CapabilityParameter(description="CLI 配置文本"),
+            "device_id": CapabilityParameter(description="目标设备 (用于与 running-config 做增量对比)")
+        },
         "returns": {"execution_status": CapabilityParameter(description="配置部署状态")}
     },
     # ----------------------------------------------------
@@ -63,21 +94,39 @@ AGENT_CONFIGS: Dict[str, Dict] = {
         "description": "编排者：使用 ADK 的编排功能，实现一个“Chain”来顺序调用其他智能体。",
         "capability": "start_qos_chain",
         "params": {"initial_trigger": CapabilityParameter(description="启动信号，可为空")},
-        "returns": {"final_report": CapabilityParameter(description="流程最终报告")}
+        "returns": {"final_report": CapabilityParameter(description="流程最终报告")},
+        "extra_capabilities": {
+            "ingest_alarm": {
+                "description": "事件入口：接收 QoS Monitor 推送的告警并放入有界队列，由编排者持续消费。",
+                "params": {"alarm": CapabilityParameter(type="object", description="告警事件 (alarm_data, source, destination)")},
+                "returns": {"accepted": CapabilityParameter(description="是否入队；队列满时为 false，发送方需退避")}
+            }
+        }
     },
 }
 
-def generate_agent_card(name: str, port: int, description: str, capability_name: str, params: Dict, returns: Dict) -> AgentCard:
-    """Generates the Agent Card object."""
+def agent_port(name: str) -> int:
+    """Port this agent listens on; AGENT_PORT overrides the default so extra replicas can run side by side."""
+    return int(os.getenv("AGENT_PORT", AGENT_CONFIGS[name]["port"]))
+
+def generate_agent_card(name: str, port: int, description: str, capability_name: str, params: Dict, returns: Dict, extra_capabilities: Dict = None) -> AgentCard:
+    """Generates the Agent Card object. extra_capabilities maps further capability names to description/params/returns."""
+    capabilities = {
+        capability_name: Capability(
+            description=description,
+            parameters={k: CapabilityParameter(**v.dict()) for k, v in params.items()},
+            returns={k: CapabilityParameter(**v.dict()) for k, v in returns.items()}
+        )
+    }
+    for extra_name, extra in (extra_capabilities or {}).items():
+        capabilities[extra_name] = Capability(
+            description=extra["description"],
+            parameters={k: CapabilityParameter(**v.dict()) for k, v in extra.get("params", {}).items()},
+            returns={k: CapabilityParameter(**v.dict()) for k, v in extra.get("returns", {}).items()}
+        )
     return AgentCard(
         name=name,
         description=description,
         endpoint=f"http://localhost:{port}/a2a",
-        capabilities={
-            capability_name: Capability(
-                description=description,
-                parameters={k: CapabilityParameter(**v.dict()) for k, v in params.items()},
-                returns={k: CapabilityParameter(**v.dict()) for k, v in returns.items()}
-            )
-        }
+        capabilities=capabilities
     )
\ No newline at end of file
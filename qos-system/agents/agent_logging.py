@@ -0,0 +1,183 @@
+import atexit
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+_LEVELS_BY_NAME = {name: level for level, name in LEVEL_NAMES.items()}
+
+# 链路追踪字段：在请求线程内设置，随日志记录一起写出
+_chain_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("chain_id", default=None)
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextmanager
+def log_context(chain_id: Optional[str] = None, trace_id: Optional[str] = None):
+    """Binds chain/trace ids to every record logged inside the block (current thread/task)."""
+    tokens = []
+    if chain_id is not None:
+        tokens.append((_chain_id, _chain_id.set(chain_id)))
+    if trace_id is not None:
+        tokens.append((_trace_id, _trace_id.set(trace_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class _LogPipeline:
+    """
+    Process-wide log pipeline: callers append raw records to a bounded ring
+    buffer (never blocks, oldest records are dropped when full) and a single
+    background thread formats and writes them. Formatting (msg % args,
+    JSON encoding of fields) only happens on the writer thread.
+    """
+
+    def __init__(self, capacity: int, flush_interval: float, stream=None):
+        self.buffer: deque = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.stream = stream or sys.stdout
+        self.json_format = os.getenv("LOG_FORMAT", "text") == "json"
+        self.appended = 0
+        self.written = 0
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def append(self, record: tuple):
+        # deque.append 是原子操作；满时自动丢弃最旧记录
+        self.buffer.append(record)
+        self.appended += 1
+
+    @property
+    def dropped(self) -> int:
+        return self.appended - self.written - len(self.buffer)
+
+    def _format(self, record: tuple) -> str:
+        ts, level, logger, msg, args, fields, chain_id, trace_id = record
+        try:
+            text = msg % args if args else msg
+        except (TypeError, ValueError):
+            text = f"{msg} {args}"
+        if self.json_format:
+            entry = {"ts": ts, "level": LEVEL_NAMES[level], "logger": logger, "msg": text}
+            if chain_id:
+                entry["chain_id"] = chain_id
+            if trace_id:
+                entry["trace_id"] = trace_id
+            entry.update(fields)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+        ids = "".join(f" {k}={v}" for k, v in (("chain_id", chain_id), ("trace_id", trace_id)) if v)
+        extra = "".join(f" {k}={json.dumps(v, default=str, ensure_ascii=False)}" for k, v in fields.items())
+        stamp = time.strftime("%H:%M:%S", time.localtime(ts)) + f".{int(ts % 1 * 1000):03d}"
+        return f"{stamp} {LEVEL_NAMES[level]:<7} [{logger}] {text}{ids}{extra}"
+
+    def flush(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self._format(self.buffer.popleft()))
+            except IndexError:
+                break
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+            self.written += len(lines)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+_pipeline: Optional[_LogPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def _get_pipeline() -> _LogPipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = _LogPipeline(
+                    capacity=int(os.getenv("LOG_BUFFER_SIZE", "10000")),
+                    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "0.05"))
+                )
+    return _pipeline
+
+
+def _sample_rates() -> Dict[int, float]:
+    # LOG_SAMPLE_DEBUG=0.1 表示只保留 10% 的 DEBUG 日志
+    return {level: float(os.getenv(f"LOG_SAMPLE_{name}", "1.0")) for level, name in LEVEL_NAMES.items()}
+
+
+class AgentLogger:
+    """
+    Structured, non-blocking logger for the agents.
+    `logger.info("Sent %s to %s", capability, receiver, latency_ms=12)`:
+    positional args are formatted lazily on the writer thread, keyword args
+    become structured fields; chain_id / trace_id come from log_context().
+    Records below the level, or dropped by per-level sampling, cost one
+    comparison.
+    """
+
+    def __init__(self, name: str, level: Optional[int] = None):
+        self.name = name
+        self.level = level if level is not None else _LEVELS_BY_NAME.get(os.getenv("LOG_LEVEL", "INFO").upper(), INFO)
+        self.sample_rates = _sample_rates()
+
+    def is_enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, msg: str, *args: Any, **fields: Any):
+        if level < self.level:
+            return
+        rate = self.sample_rates.get(level, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        _get_pipeline().append((time.time(), level, self.name, msg, args, fields, _chain_id.get(), _trace_id.get()))
+
+    def debug(self, msg: str, *args: Any, **fields: Any):
+        self.log(DEBUG, msg, *args, **fields)
+
+    def info(self, msg: str, *args: Any, **fields: Any):
+        self.log(INFO, msg, *args, **fields)
+
+    def warning(self, msg: str, *args: Any, **fields: Any):
+        self.log(WARNING, msg, *args, **fields)
+
+    def error(self, msg: str, *args: Any, **fields: Any):
+        self.log(ERROR, msg, *args, **fields)
+
+
+def get_logger(name: str) -> AgentLogger:
+    return AgentLogger(name)
+
+
+def pipeline_stats() -> Dict[str, int]:
+    """Ring buffer counters (appended / written / dropped / buffered)."""
+    pipeline = _get_pipeline()
+    return {"appended": pipeline.appended, "written": pipeline.written, "dropped": pipeline.dropped, "buffered": len(pipeline.buffer)}
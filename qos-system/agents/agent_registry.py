@@ -0,0 +1,189 @@
+import os
+import random
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from models.a2a_models import AgentCard
+from .resilience import CircuitBreaker, CircuitOpenError
+from .agent_logging import get_logger
+from .serving import acquire_singleton
+
+log = get_logger("AgentRegistry")
+
+
+class Replica:
+    """One running instance of an agent: its card, in-flight request count and health."""
+
+    def __init__(self, card: AgentCard):
+        self.card = card
+        self.outstanding = 0
+        self.breaker = CircuitBreaker(f"{card.name} @ {card.endpoint}")
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def describe(self) -> Dict[str, object]:
+        return {"endpoint": self.card.endpoint, "outstanding": self.outstanding, "circuit": self.breaker.state}
+
+
+class AgentRegistry:
+    """
+    Registry of agent replicas for the Orchestrator.
+    Several cards may be registered under the same agent name (one per
+    endpoint). `acquire()` picks the
+    healthy replica with the fewest outstanding requests (ties broken
+    randomly) and must be paired with `release()`.
+    """
+
+    def __init__(self):
+        self._replicas: Dict[str, Dict[str, Replica]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, card: AgentCard) -> Replica:
+        """Adds (or refreshes) a replica; keyed by agent name + endpoint."""
+        with self._lock:
+            replicas = self._replicas.setdefault(card.name, {})
+            replica = replicas.get(card.endpoint)
+            if replica is None:
+                replica = Replica(card)
+                replicas[card.endpoint] = replica
+            else:
+                replica.card = card
+            return replica
+
+    def deregister(self, agent_name: str, endpoint: str) -> bool:
+        with self._lock:
+            replicas = self._replicas.get(agent_name, {})
+            removed = replicas.pop(endpoint, None) is not None
+            if not replicas:
+                self._replicas.pop(agent_name, None)
+            return removed
+
+    # 读取方同样持锁并返回副本：注册 / 注销可能在其他线程中同时进行
+    def __contains__(self, agent_name: str) -> bool:
+        with self._lock:
+            return bool(self._replicas.get(agent_name))
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._replicas.keys())
+
+    def cards(self, agent_name: str) -> List[AgentCard]:
+        with self._lock:
+            return [replica.card for replica in self._replicas.get(agent_name, {}).values()]
+
+    def acquire(self, agent_name: str, exclude: Optional[Replica] = None) -> Replica:
+        """
+        Least-outstanding-requests selection among healthy replicas.
+        Raises ValueError if the agent is unknown and CircuitOpenError if
+        every replica is unhealthy.
+        """
+        with self._lock:
+            replicas = list(self._replicas.get(agent_name, {}).values())
+            if not replicas:
+                raise ValueError(f"Agent {agent_name} not discovered. Cannot call capability.")
+            candidates = [r for r in replicas if r is not exclude] or replicas
+            # 先选健康 (非 OPEN) 的副本；若全部熔断，交给 before_call 判断是否到了半开试探时间
+            healthy = [r for r in candidates if r.healthy] or candidates
+            least = min(r.outstanding for r in healthy)
+            replica = random.choice([r for r in healthy if r.outstanding == least])
+            replica.outstanding += 1
+        try:
+            replica.breaker.before_call()
+        except CircuitOpenError:
+            self.release(replica)
+            raise CircuitOpenError(f"All replicas of {agent_name} are unavailable (circuit open)")
+        return replica
+
+    def release(self, replica: Replica):
+        with self._lock:
+            replica.outstanding = max(replica.outstanding - 1, 0)
+
+    def agent_state(self, agent_name: str) -> Optional[str]:
+        """'closed' if any replica is healthy, otherwise the breaker state; None if unknown."""
+        with self._lock:
+            replicas = list(self._replicas.get(agent_name, {}).values())
+        if not replicas:
+            return None
+        if any(r.breaker.state == CircuitBreaker.CLOSED for r in replicas):
+            return CircuitBreaker.CLOSED
+        return replicas[0].breaker.state
+
+    def snapshot(self) -> Dict[str, List[Dict[str, object]]]:
+        """Per-agent replica list with load and health, for metrics."""
+        with self._lock:
+            return {name: [r.describe() for r in replicas.values()] for name, replicas in self._replicas.items()}
+
+
+# 副本自注册：设置 ORCHESTRATOR_URL (例如 http://localhost:8006) 后，Agent 启动时向编排者注册，关闭时注销
+ORCHESTRATOR_URL_ENV = "ORCHESTRATOR_URL"
+# 注册心跳周期 (秒)：编排者重启后会丢失运行时注册，副本按此周期重新注册
+HEARTBEAT_INTERVAL = float(os.getenv("REGISTRY_HEARTBEAT_INTERVAL", "30"))
+
+
+def _notify_orchestrator(action: str, card: AgentCard) -> bool:
+    base_url = os.getenv(ORCHESTRATOR_URL_ENV)
+    if not base_url:
+        return False
+    try:
+        response = requests.post(f"{base_url.rstrip('/')}/registry/{action}", json=card.model_dump(), timeout=3)
+        response.raise_for_status()
+        log.info("%s %s at %s with orchestrator", action, card.name, card.endpoint)
+        return True
+    except requests.exceptions.RequestException as e:
+        log.warning("Could not %s %s with orchestrator: %s", action, card.name, e)
+        return False
+
+
+def register_with_orchestrator(card: AgentCard) -> bool:
+    return _notify_orchestrator("register", card)
+
+
+def deregister_from_orchestrator(card: AgentCard) -> bool:
+    return _notify_orchestrator("deregister", card)
+
+
+class RegistrationHeartbeat:
+    """
+    Keeps a replica registered with the Orchestrator (only if ORCHESTRATOR_URL
+    is set). Registration is retried with backoff until it succeeds, since
+    replicas usually start before the Orchestrator, and then repeated every
+    `interval` seconds, so that a restarted Orchestrator learns the replica
+    again. One worker per replica (keyed by its port) sends the heartbeat.
+    """
+
+    def __init__(self, card: AgentCard, interval: float = HEARTBEAT_INTERVAL):
+        self.card = card
+        self.interval = interval
+        self._stop = threading.Event()
+        self._started = False
+
+    def start(self):
+        # 锁名包含副本端口：共用 QOS_SHARED_DIR 时每个 Agent / 副本各自选出一个 worker
+        replica_key = urlsplit(self.card.endpoint).port or self.card.endpoint
+        if not os.getenv(ORCHESTRATOR_URL_ENV) or not acquire_singleton(f"registry-heartbeat-{replica_key}"):
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="registry-heartbeat", daemon=True).start()
+
+    def _run(self):
+        retry_delay = 1.0
+        while not self._stop.is_set():
+            if register_with_orchestrator(self.card):
+                retry_delay = 1.0
+                delay = self.interval
+            else:
+                # 编排者尚未启动或暂时不可达：指数退避重试，上限为心跳周期
+                delay = retry_delay
+                retry_delay = min(retry_delay * 2, self.interval)
+            self._stop.wait(delay)
+
+    def stop(self):
+        """Stops the heartbeat and deregisters the replica."""
+        if self._started:
+            self._stop.set()
+            deregister_from_orchestrator(self.card)
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# 队列满时的处理策略
+DROP_OLDEST = "drop_oldest"  # 丢弃最旧的告警，接收新告警
+REJECT = "reject"            # 拒绝新告警，由发送方退避重试 (backpressure)
+
+
+class AlarmQueue:
+    """
+    Bounded, in-process alarm queue between the QoS Monitor and the Orchestrator.
+    Alarms with the same key (e.g. the same congested link) are merged in place:
+    the newer alarm replaces the queued one without changing its position, so a
+    flapping link never occupies more than one slot. When the queue is full,
+    `overflow_policy` decides whether the oldest alarm is dropped or the new
+    one is rejected.
+    """
+
+    def __init__(self, maxsize: int = 32, overflow_policy: str = REJECT):
+        if overflow_policy not in (DROP_OLDEST, REJECT):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._counters = {"enqueued": 0, "merged": 0, "dropped": 0, "rejected": 0, "dequeued": 0}
+        self._high_watermark = 0
+
+    def put(self, key: str, alarm: Dict[str, Any]) -> Tuple[bool, str]:
+        """Offers an alarm. Returns (accepted, outcome) where outcome is enqueued/merged/dropped_oldest/rejected."""
+        with self._cond:
+            if key in self._items:
+                self._items[key] = alarm
+                self._counters["merged"] += 1
+                return True, "merged"
+
+            outcome = "enqueued"
+            if len(self._items) >= self.maxsize:
+                if self.overflow_policy == REJECT:
+                    self._counters["rejected"] += 1
+                    return False, "rejected"
+                self._items.popitem(last=False)
+                self._counters["dropped"] += 1
+                outcome = "dropped_oldest"
+
+            self._items[key] = alarm
+            self._counters["enqueued"] += 1
+            self._high_watermark = max(self._high_watermark, len(self._items))
+            self._cond.notify()
+            return True, outcome
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Blocks until an alarm is available (or timeout expires, returning None)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            _, alarm = self._items.popitem(last=False)
+            self._counters["dequeued"] += 1
+            return alarm
+
+    def drain(self, max_items: int) -> List[Dict[str, Any]]:
+        """Removes and returns up to max_items queued alarms without blocking."""
+        alarms = []
+        with self._cond:
+            while self._items and len(alarms) < max_items:
+                alarms.append(self._items.popitem(last=False)[1])
+            self._counters["dequeued"] += len(alarms)
+        return alarms
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and counters, exposed as metrics."""
+        with self._cond:
+            return {
+                "depth": len(self._items),
+                "maxsize": self.maxsize,
+                "high_watermark": self._high_watermark,
+                "overflow_policy": self.overflow_policy,
+                **self._counters,
+            }
+
+
+def alarm_key(alarm: Dict[str, Any]) -> str:
+    """Merge key of an alarm event: the congested link if known, otherwise the alarm id."""
+    source = alarm.get("source")
+    destination = alarm.get("destination")
+    if source and destination:
+        return f"{source}->{destination}"
+    return alarm.get("alarm_data", {}).get("alarm_id", "unknown")
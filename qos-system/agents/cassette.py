@@ -0,0 +1,244 @@
+import builtins
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+from .agent_logging import get_logger
+
+log = get_logger("Cassette")
+
+# CASSETTE_MODE=record|replay 启用录制/回放；CASSETTE_PATH 为 cassette 文件 (所有 Agent 进程共用一个文件)
+# CASSETTE_TIMING=fast (默认，立即返回) | original (按录制时的耗时等待后返回)
+MODE_ENV = "CASSETTE_MODE"
+PATH_ENV = "CASSETTE_PATH"
+TIMING_ENV = "CASSETTE_TIMING"
+RECORD, REPLAY = "record", "replay"
+
+
+class CassetteMissError(ConnectionError):
+    """Raised in replay mode when the cassette has no recorded response for a request."""
+
+
+def _compact(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, sort_keys=True, default=str)
+
+
+def request_key(kind: str, name: str, request: Any) -> str:
+    """Stable key of an interaction; only this hash is stored, not the (large) request itself."""
+    return hashlib.sha1(f"{kind}|{name}|{_compact(request)}".encode("utf-8")).hexdigest()[:20]
+
+
+class Cassette:
+    """
+    Records external interactions (A2A calls, structured LLM results, knowledge
+    graph queries) as one compact JSON line each, and replays them without
+    touching the network. Replay matches on the request hash; requests that
+    differ only in volatile fields fall back to the next unused recording of
+    the same kind and name, in recorded order.
+    """
+
+    def __init__(self, path: str, mode: str, timing: str = "fast"):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.original_timing = timing == "original"
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_name: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.counters = {"recorded": 0, "replayed": 0, "approximate": 0, "misses": 0}
+        if mode == REPLAY:
+            self._load()
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._by_key[entry["key"]].append(entry)
+                self._by_name[f"{entry['kind']}|{entry['name']}"].append(entry)
+        log.info("Loaded %d recorded interactions from %s", sum(len(q) for q in self._by_key.values()), self.path)
+
+    def _append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+        # 多个 Agent 进程写同一个文件：每条记录一次 write，并用 flock 串行化
+        with open(self.path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, kind: str, name: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            exact = self._by_key.get(key)
+            entry = exact.popleft() if exact else None
+            if entry is None:
+                # 精确匹配失败 (例如请求中含时间戳)：按录制顺序取同类的下一条
+                candidates = self._by_name.get(f"{kind}|{name}")
+                while candidates and candidates[0].get("used"):
+                    candidates.popleft()
+                if not candidates:
+                    self.counters["misses"] += 1
+                    raise CassetteMissError(f"No recorded {kind} response for {name} in {self.path}")
+                entry = candidates.popleft()
+                self._by_key[entry["key"]].remove(entry)
+                self.counters["approximate"] += 1
+                log.warning("No exact recording for %s %s, replaying the next one in order", kind, name)
+            entry["used"] = True
+            self.counters["replayed"] += 1
+        return entry
+
+    def exchange(self, kind: str, name: str, request: Any, call: Callable[[], Any],
+                 encode: Callable[[Any], Any] = None, decode: Callable[[Any], Any] = None) -> Any:
+        """Records call() (result or exception) in record mode; returns the recorded outcome in replay mode."""
+        key = request_key(kind, name, request)
+        if self.mode == REPLAY:
+            entry = self._take(kind, name, key)
+            if self.original_timing:
+                time.sleep(entry.get("elapsed", 0.0))
+            if "error" in entry:
+                error_type = getattr(builtins, entry.get("error_type", ""), None)
+                if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+                    error_type = RuntimeError
+                raise error_type(entry["error"])
+            response = entry.get("response")
+            return decode(response) if decode else response
+
+        entry = {"kind": kind, "name": name, "key": key, "ts": round(time.time(), 3)}
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception as e:
+            # 回放时只能还原内置异常类型：记录最接近的内置基类 (例如 CallTimeoutError -> ConnectionError)
+            error_type = next(c for c in type(e).__mro__ if getattr(builtins, c.__name__, None) is c)
+            entry.update(error=str(e), error_type=error_type.__name__, elapsed=round(time.perf_counter() - started, 4))
+            self._append(entry)
+            raise
+        entry.update(response=encode(result) if encode else result, elapsed=round(time.perf_counter() - started, 4))
+        self._append(entry)
+        with self._lock:
+            self.counters["recorded"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "path": self.path, **self.counters}
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+_checked = False
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Process-wide cassette configured from the environment, or None when recording/replay is off."""
+    global _cassette, _checked
+    if not _checked:
+        with _cassette_lock:
+            if not _checked:
+                mode = os.getenv(MODE_ENV, "").lower()
+                if mode:
+                    _cassette = Cassette(os.getenv(PATH_ENV, "qos_cassette.jsonl"), mode, os.getenv(TIMING_ENV, "fast").lower())
+                    log.info("Cassette %s mode, file %s", mode, _cassette.path)
+                _checked = True
+    return _cassette
+
+
+def replayable(kind: str, name: str, request: Any, call: Callable[[], Any],
+               encode: Callable[[Any], Any] = None, decode: Callable[[Any], Any] = None) -> Any:
+    """Runs call() directly, or through the cassette when CASSETTE_MODE is set."""
+    cassette = get_cassette()
+    if cassette is None:
+        return call()
+    return cassette.exchange(kind, name, request, call, encode, decode)
+
+
+class _StructuredCall:
+    """Result of CassetteLLM.with_structured_output(): records/replays invoke() as the schema's JSON."""
+
+    def __init__(self, schema: Any, runnable: Any):
+        self.schema = schema
+        self.runnable = runnable
+
+    def invoke(self, prompt: Any, *args: Any, **kwargs: Any) -> Any:
+        return replayable(
+            "llm", getattr(self.schema, "__name__", str(self.schema)), prompt,
+            lambda: self.runnable.invoke(prompt, *args, **kwargs),
+            encode=lambda result: result.model_dump() if hasattr(result, "model_dump") else result,
+            decode=lambda data: self.schema(**data) if isinstance(data, dict) and isinstance(self.schema, type) else data
+        )
+
+
+class CassetteLLM:
+    """Chat model wrapper; in replay mode there is no underlying client at all."""
+
+    def __init__(self, llm: Any = None):
+        self._llm = llm
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> _StructuredCall:
+        return _StructuredCall(schema, self._llm.with_structured_output(schema, **kwargs) if self._llm is not None else None)
+
+    def __getattr__(self, name: str) -> Any:
+        if self._llm is None:
+            raise AttributeError(f"'{name}' is not available on a replayed LLM")
+        return getattr(self._llm, name)
+
+
+class CassetteTool:
+    """Tool wrapper (e.g. the MCP query_knowledge_graph tool) recording invoke() results."""
+
+    def __init__(self, name: str, tool: Any = None):
+        self.name = name
+        self._tool = tool
+
+    def invoke(self, tool_input: Any, *args: Any, **kwargs: Any) -> Any:
+        return replayable("tool", self.name, tool_input, lambda: self._tool.invoke(tool_input, *args, **kwargs))
+
+
+def cassette_llm(build: Callable[[], Any]) -> Any:
+    """Builds the LLM client, wrapped for recording; in replay mode the client is never built."""
+    cassette = get_cassette()
+    if cassette is None:
+        return build()
+    return CassetteLLM(None if cassette.mode == REPLAY else build())
+
+
+def cassette_tool(name: str, build: Callable[[], Any]) -> Any:
+    """Same as cassette_llm for a tool; build() may return None when the tool is unavailable."""
+    cassette = get_cassette()
+    if cassette is None:
+        return build()
+    if cassette.mode == REPLAY:
+        return CassetteTool(name)
+    tool = build()
+    return CassetteTool(name, tool) if tool is not None else None
+
+
+def summarize(path: str) -> Dict[str, Dict[str, Any]]:
+    """Per kind/name: number of recorded interactions, errors and total recorded time."""
+    summary: Dict[str, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            item = summary.setdefault(f"{entry['kind']} {entry['name']}", {"calls": 0, "errors": 0, "recorded_s": 0.0})
+            item["calls"] += 1
+            item["errors"] += "error" in entry
+            item["recorded_s"] = round(item["recorded_s"] + entry.get("elapsed", 0.0), 3)
+    return summary
+
+
+if __name__ == "__main__":
+    # 用法: python -m agents.cassette <cassette 文件>  —— 按类别汇总录制的交互及其耗时
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getenv(PATH_ENV, "qos_cassette.jsonl")
+    for label, item in sorted(summarize(target).items(), key=lambda kv: -kv[1]["recorded_s"]):
+        print(f"{label:<50} calls={item['calls']:<5} errors={item['errors']:<3} recorded={item['recorded_s']:.3f}s")
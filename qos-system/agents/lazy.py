@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+from .agent_logging import get_logger
+from .cassette import cassette_llm
+
+log = get_logger("LazyResource")
+
+
+class LazyResource:
+    """
+    A heavy object (LLM client, MCP tool, compiled graph...) built on first use.
+    `warm_up_in_background()` lets a server start building it right after the
+    port opens, so the first request usually finds it ready; `get()` blocks
+    until it is built, building it itself if nobody has started yet.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value: Any = None
+        self._ready = False
+        self.build_seconds: Optional[float] = None
+
+    def get(self) -> Any:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                started = time.perf_counter()
+                # 构建失败时异常直接抛出且不缓存，下次调用会重试
+                self._value = self._factory()
+                self.build_seconds = time.perf_counter() - started
+                self._ready = True
+                log.info("%s ready in %.2fs", self.name, self.build_seconds)
+        return self._value
+
+    def warm_up_in_background(self):
+        """Starts building the resource on a daemon thread; errors surface on the next get()."""
+        def _warm():
+            try:
+                self.get()
+            except Exception as e:
+                log.error("Warm-up of %s failed: %s", self.name, e)
+        threading.Thread(target=_warm, name=f"warmup-{self.name}", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+
+def gemini_llm() -> Any:
+    """
+    Builds the Gemini chat client; the langchain import happens here, not at module import.
+    With CASSETTE_MODE set, structured outputs are recorded / replayed (no client in replay mode).
+    """
+    def build():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=os.getenv("GEMINI_API_KEY"))
+    return cassette_llm(build)
@@ -0,0 +1,148 @@
+import ast
+import json
+import textwrap
+import threading
+from .agent_logging import get_logger
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+
+# 粗略估算：英文/JSON 文本平均约 4 个字符对应 1 个 token
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 2048
+TRUNCATION_MARKER = "...[truncated]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, dependency-free token estimate used for budgeting prompts."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def compact_json(data: Any) -> str:
+    """Serializes data as minified JSON (no indentation, no spaces after separators)."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text down to roughly max_tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER), 0)
+    return text[:keep] + TRUNCATION_MARKER
+
+
+def compact_cli(cli_text: str) -> str:
+    """Strips blank lines and trailing whitespace from CLI text, keeping indentation."""
+    lines = [line.rstrip() for line in cli_text.splitlines()]
+    return "\n".join(line for line in lines if line.strip())
+
+
+def _parse_rows(db_result: Any) -> Optional[List[Any]]:
+    """Parses the MCP tool output (str(list_of_dicts)) back into rows, if possible."""
+    if isinstance(db_result, list):
+        return db_result
+    if not isinstance(db_result, str):
+        return None
+    try:
+        rows = ast.literal_eval(db_result.strip())
+    except (ValueError, SyntaxError):
+        return None
+    return rows if isinstance(rows, list) else None
+
+
+def _row_rank(row: Any) -> Tuple[int, float]:
+    """Shorter paths first, then larger spare capacity (if the row exposes one)."""
+    if not isinstance(row, dict):
+        return (0, 0.0)
+    hops = 0
+    spare = 0.0
+    for key, value in row.items():
+        if isinstance(value, list):
+            hops = max(hops, len(value))
+        elif isinstance(value, (int, float)) and any(k in key.lower() for k in ("avail", "spare", "free", "headroom")):
+            spare = max(spare, float(value))
+    return (hops, -spare)
+
+
+def compact_rows(db_result: Any, max_rows: int = 5) -> str:
+    """
+    Compacts a Neo4j result for an LLM prompt: rows are deduplicated, ranked
+    (shortest path / most headroom first) and only the top max_rows are kept,
+    with a one-line summary of what was dropped.
+    """
+    rows = _parse_rows(db_result)
+    if rows is None:
+        return compact_cli(str(db_result))
+    if not rows:
+        return "[]"
+
+    unique_rows: List[Any] = []
+    seen = set()
+    for row in rows:
+        key = compact_json(row)
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append(row)
+
+    ranked = sorted(unique_rows, key=_row_rank)
+    kept = ranked[:max_rows]
+    text = "\n".join(compact_json(row) for row in kept)
+    dropped = len(rows) - len(kept)
+    if dropped > 0:
+        text += f"\n({len(rows)} rows total, {len(rows) - len(unique_rows)} duplicates, {len(unique_rows) - len(kept)} lower-ranked rows omitted)"
+    return text
+
+
+class PromptBuilder:
+    """
+    Shared prompt-building layer for the LLM-backed agents.
+    Assembles a prompt from a fixed template plus named data sections and
+    enforces a per-call token budget: when the prompt is too large, the
+    lowest-priority sections are truncated first. The token count of every
+    built prompt is logged and accumulated in `stats`
+    (served by the agents at GET /prompts).
+    """
+
+    def __init__(self, owner: str, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.owner = owner
+        self.token_budget = token_budget
+        self.log = get_logger(owner)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def build(self, name: str, template: str, sections: Dict[str, Tuple[str, int]], token_budget: Optional[int] = None) -> str:
+        """
+        Renders `template` (string.Template syntax, placeholders written as $name)
+        with the given sections. sections maps a placeholder name to
+        (text, priority); a higher priority means the section is kept intact
+        for longer when trimming. Template indentation is stripped.
+        token_budget overrides the builder's budget for this call (e.g. batches).
+        """
+        budget = token_budget if token_budget is not None else self.token_budget
+        texts = {key: text for key, (text, _) in sections.items()}
+        tpl = Template(textwrap.dedent(template).strip())
+        fixed_tokens = estimate_tokens(tpl.safe_substitute({key: "" for key in sections}))
+        available = max(budget - fixed_tokens, 0)
+
+        # 按优先级从低到高裁剪，直到满足预算
+        for key, _ in sorted(sections.items(), key=lambda item: item[1][1]):
+            overflow = sum(estimate_tokens(t) for t in texts.values()) - available
+            if overflow <= 0:
+                break
+            current = estimate_tokens(texts[key])
+            texts[key] = truncate_to_tokens(texts[key], max(current - overflow, 0))
+
+        prompt = tpl.safe_substitute(texts)
+        self._record(name, estimate_tokens(prompt), budget)
+        return prompt
+
+    def _record(self, name: str, tokens: int, budget: int):
+        with self._lock:
+            entry = self.stats.setdefault(name, {"calls": 0, "last_tokens": 0, "max_tokens": 0, "total_tokens": 0})
+            entry["calls"] += 1
+            entry["last_tokens"] = tokens
+            entry["max_tokens"] = max(entry["max_tokens"], tokens)
+            entry["total_tokens"] += tokens
+        # INFO 级别的结构化字段，便于按 prompt 统计 token 消耗
+        self.log.info("Built prompt '%s'", name, tokens=tokens, budget=budget)
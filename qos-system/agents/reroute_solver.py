@@ -0,0 +1,231 @@
+import heapq
+from typing import Any, Dict, List, Optional
+
+from models.a2a_models import RemediationPlan
+
+# 重路由后任何链路的利用率都不应超过该目标值，避免引发第二波告警
+DEFAULT_TARGET_UTILIZATION = 0.8
+EPSILON = 1e-6
+
+
+class RerouteSolver:
+    """
+    Network-wide rerouting engine over the topology's link capacity/load data.
+
+    Every congested link (load above target utilization) becomes a demand: the
+    excess traffic must move from its source to its destination over other
+    links. All demands are routed against ONE shared residual-capacity view
+    (headroom = target * capacity - load), using successive shortest
+    augmenting paths (hop-bounded Dijkstra) with a load-aware cost, so two
+    reroutes can never be placed on the same spare capacity. Demands may be
+    split across paths.
+
+    topology["links"] entries: {source, destination, capacity, load,
+    interface?, cost?} (Mbps; cost defaults to 1 per hop).
+    """
+
+    def __init__(self, links: List[Dict[str, Any]], target_utilization: float = DEFAULT_TARGET_UTILIZATION,
+                 max_paths_per_demand: int = 4, max_hops: int = 6):
+        self.target_utilization = target_utilization
+        self.max_paths_per_demand = max_paths_per_demand
+        # 绕行路径的最大跳数：限制搜索范围，保证大网络下的求解时间
+        self.max_hops = max_hops
+        self._node_index: Dict[str, int] = {}
+        self.nodes: List[str] = []
+        # 边以并列数组存储 (struct-of-arrays)，便于热循环快速访问
+        self.src: List[int] = []
+        self.dst: List[int] = []
+        self.capacity: List[float] = []
+        self.load: List[float] = []
+        self.cost: List[float] = []
+        self.interface: List[Optional[str]] = []
+        self.adjacency: List[List[int]] = []
+        for link in links:
+            self._add_link(link)
+
+    @classmethod
+    def from_topology(cls, topology: Dict[str, Any], **kwargs) -> "RerouteSolver":
+        return cls(topology.get("links", []), **kwargs)
+
+    def _node(self, name: str) -> int:
+        index = self._node_index.get(name)
+        if index is None:
+            index = len(self.nodes)
+            self._node_index[name] = index
+            self.nodes.append(name)
+            self.adjacency.append([])
+        return index
+
+    def _add_link(self, link: Dict[str, Any]):
+        u, v = self._node(link["source"]), self._node(link["destination"])
+        self.adjacency[u].append(len(self.src))
+        self.src.append(u)
+        self.dst.append(v)
+        self.capacity.append(float(link["capacity"]))
+        self.load.append(float(link.get("load", 0.0)))
+        self.cost.append(float(link.get("cost", 1.0)))
+        self.interface.append(link.get("interface"))
+
+    def _headroom(self, edge: int) -> float:
+        return self.target_utilization * self.capacity[edge] - self.load[edge]
+
+    def congested_demands(self, only: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        One demand per link loaded above target utilization (excess traffic to move).
+        `only` restricts the result to the given {source, destination} links.
+        """
+        wanted = None if only is None else {(link["source"], link["destination"]) for link in only}
+        demands = []
+        for edge in range(len(self.src)):
+            if wanted is not None and (self.nodes[self.src[edge]], self.nodes[self.dst[edge]]) not in wanted:
+                continue
+            excess = -self._headroom(edge)
+            if excess > EPSILON:
+                demands.append({
+                    "source": self.nodes[self.src[edge]],
+                    "destination": self.nodes[self.dst[edge]],
+                    "demand_mbps": excess,
+                })
+        return demands
+
+    def _shortest_path(self, source: int, target: int, excluded: set) -> Optional[List[int]]:
+        """Dijkstra over edges with spare headroom; edge weight grows with utilization."""
+        dist = {source: 0.0}
+        prev_edge: Dict[int, int] = {}
+        heap = [(0.0, 0, source)]
+        adjacency, dst, load, capacity, cost = self.adjacency, self.dst, self.load, self.capacity, self.cost
+        target_util, max_hops = self.target_utilization, self.max_hops
+        while heap:
+            d, hops, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if d > dist.get(u, float("inf")) or hops >= max_hops:
+                continue
+            for edge in adjacency[u]:
+                if edge in excluded or target_util * capacity[edge] - load[edge] <= EPSILON:
+                    continue
+                # 代价 = 跳数代价 * (1 + 当前利用率)，倾向于空闲链路
+                nd = d + cost[edge] * (1.0 + load[edge] / capacity[edge])
+                v = dst[edge]
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    prev_edge[v] = edge
+                    heapq.heappush(heap, (nd, hops + 1, v))
+        if target not in prev_edge:
+            return None
+        path = []
+        node = target
+        while node != source:
+            edge = prev_edge[node]
+            path.append(edge)
+            node = self.src[edge]
+        path.reverse()
+        return path
+
+    def _edges_between(self, u: int, v: int) -> List[int]:
+        return [edge for edge in self.adjacency[u] if self.dst[edge] == v]
+
+    def solve(self, demands: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Routes all demands (default: every congested link) against shared
+        residual capacity. Largest demands are placed first. Returns one entry
+        per demand with the paths used and any traffic that could not be placed.
+        """
+        if demands is None:
+            demands = self.congested_demands()
+        results = []
+        for demand in sorted(demands, key=lambda d: d["demand_mbps"], reverse=True):
+            u = self._node_index.get(demand["source"])
+            v = self._node_index.get(demand["destination"])
+            entry = {**demand, "routed_mbps": 0.0, "paths": []}
+            results.append(entry)
+            if u is None or v is None:
+                entry["unrouted_mbps"] = demand["demand_mbps"]
+                continue
+
+            direct = self._edges_between(u, v)
+            excluded = set(direct)
+            remaining = demand["demand_mbps"]
+            for _ in range(self.max_paths_per_demand):
+                if remaining <= EPSILON:
+                    break
+                path = self._shortest_path(u, v, excluded)
+                if path is None:
+                    break
+                flow = min(remaining, min(self._headroom(edge) for edge in path))
+                for edge in path:
+                    self.load[edge] += flow
+                # 被绕开的流量从直连链路上移走，保持全网负载视图一致
+                for edge in direct:
+                    self.load[edge] = max(self.load[edge] - flow / len(direct), 0.0)
+                remaining -= flow
+                entry["routed_mbps"] += flow
+                entry["paths"].append({
+                    "hops": [self.nodes[u]] + [self.nodes[self.dst[edge]] for edge in path],
+                    "first_hop_interface": self.interface[path[0]],
+                    "mbps": round(flow, 3),
+                })
+            entry["routed_mbps"] = round(entry["routed_mbps"], 3)
+            entry["unrouted_mbps"] = round(max(remaining, 0.0), 3)
+        return results
+
+    def link_loads(self) -> List[Dict[str, Any]]:
+        """Link loads after the solved reroutes (for verification/reporting)."""
+        return [
+            {
+                "source": self.nodes[self.src[edge]],
+                "destination": self.nodes[self.dst[edge]],
+                "capacity": self.capacity[edge],
+                "load": round(self.load[edge], 3),
+            }
+            for edge in range(len(self.src))
+        ]
+
+
+def apply_reroute(links: List[Dict[str, Any]], plan: RemediationPlan, reverse: bool = False):
+    """
+    Updates topology["links"] loads in place with the traffic a plan moves
+    (same accounting as RerouteSolver.solve), so that the next solve does not
+    hand out the spare capacity this plan already took. reverse=True undoes
+    it (e.g. releasing the reservation of a plan that failed to deploy).
+    """
+    sign = -1.0 if reverse else 1.0
+    by_pair: Dict[tuple, List[Dict[str, Any]]] = {}
+    for link in links:
+        by_pair.setdefault((link["source"], link["destination"]), []).append(link)
+    direct = by_pair.get((plan.device_id, plan.actions.get("destination")), [])
+    for path in plan.actions.get("paths", []):
+        hops, flow = path["hops"], sign * float(path["mbps"])
+        for u, v in zip(hops, hops[1:]):
+            # 并行链路无法从 hops 区分，计入第一条
+            edges = by_pair.get((u, v))
+            if edges:
+                edges[0]["load"] = round(max(float(edges[0].get("load", 0.0)) + flow, 0.0), 3)
+        for link in direct:
+            link["load"] = round(max(float(link.get("load", 0.0)) - flow / len(direct), 0.0), 3)
+
+
+def to_remediation_plans(solution: List[Dict[str, Any]], plan_prefix: str = "BATCH") -> List[RemediationPlan]:
+    """Turns a solver solution into one RemediationPlan per routed demand."""
+    plans = []
+    for index, entry in enumerate(solution, start=1):
+        if not entry["paths"]:
+            continue
+        primary = max(entry["paths"], key=lambda p: p["mbps"])
+        reason = "; ".join(f"{p['mbps']} Mbps via {' -> '.join(p['hops'])}" for p in entry["paths"])
+        if entry["unrouted_mbps"] > 0:
+            reason += f"; {entry['unrouted_mbps']} Mbps could not be placed"
+        plans.append(RemediationPlan(
+            plan_id=f"{plan_prefix}-{index:03d}",
+            device_id=entry["source"],
+            # 需搬移的流量越大，优先级越高 (1 为最高)
+            priority=index,
+            actions={
+                "interface": primary["first_hop_interface"] or f"interface_to_{primary['hops'][1]}",
+                "new_qos_level": "PBR_Redirect",
+                "reason": f"Reroute {entry['routed_mbps']} Mbps of {entry['source']} -> {entry['destination']}: {reason}",
+                "destination": entry["destination"],
+                "paths": entry["paths"],
+            }
+        ))
+    return plans
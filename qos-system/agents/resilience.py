@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed call latencies for one agent.
+    Used by the Orchestrator to derive per-agent timeouts from percentiles
+    instead of a single fixed timeout.
+    """
+
+    def __init__(self, window: int = 100, min_samples: int = 5):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Returns the pct-th percentile (0-100), or None if there is not enough data yet."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def timeout(self, default: float, floor: float, ceiling: float, pct: float = 99.0, multiplier: float = 2.0) -> float:
+        """Timeout = multiplier * pct-th percentile, clamped to [floor, ceiling]; default until warmed up."""
+        observed = self.percentile(pct)
+        if observed is None:
+            return default
+        return min(max(observed * multiplier, floor), ceiling)
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised when a call is rejected because the target agent's circuit is open."""
+
+
+class CallTimeoutError(ConnectionError):
+    """Raised when a remote agent does not answer within the call's (read) timeout."""
+
+
+class OverloadedError(ConnectionError):
+    """Raised when an agent sheds a request (admission control); it may be retried after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open circuit breaker.
+    - CLOSED: calls pass; `failure_threshold` consecutive failures open the circuit.
+    - OPEN: calls fail fast until `reset_timeout` seconds have passed.
+    - HALF_OPEN: a single trial call is allowed; success closes, failure re-opens.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be attempted."""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(f"Circuit for {self.name} is open (retry in {remaining:.1f}s)")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"Circuit for {self.name} is half-open (trial call in flight)")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
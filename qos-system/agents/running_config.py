@@ -0,0 +1,236 @@
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .serving import cross_worker_lock
+
+# 这些是 EXEC / 模式切换命令，不属于配置本身，解析与对比时忽略
+MODE_COMMANDS = {"configure terminal", "conf t", "end", "write memory", "wr", "copy running-config startup-config", "copy run start"}
+PERSIST_COMMANDS = ("write memory", "copy running-config startup-config", "copy run start")
+
+# 进入配置子模式的命令：其后的命令属于该段落，直到 exit / 下一个段落头 (不依赖缩进)
+SECTION_HEADERS = ("interface ", "router ", "route-map ", "policy-map ", "class-map ", "ip access-list ", "line ", "vlan ", "key chain ")
+# 段落内可再嵌套的子模式，例如 policy-map 下的 class
+SUBSECTION_HEADERS = {"policy-map ": ("class ",), "router ": ("address-family ",), "key chain ": ("key ",)}
+# 只在全局模式下有效的命令：出现在子模式中 (无缩进) 时 IOS 会退回全局模式执行
+GLOBAL_COMMANDS = ("ip route ", "ipv6 route ", "hostname ", "access-list ", "ip domain", "ip name-server ", "snmp-server ", "username ", "banner ", "service ")
+# 单值设置：新值替换同一前缀的旧值，而不是与之并存
+SINGLE_VALUED = ("service-policy input", "service-policy output", "ip address", "description", "bandwidth", "mtu", "speed",
+                 "duplex", "encapsulation", "ip ospf cost", "hostname", "set ip next-hop", "priority", "shape average")
+
+# 配置树：每一行命令 -> 子配置树 (保持插入顺序)
+ConfigTree = Dict[str, "ConfigTree"]
+
+
+def _header(line: str) -> Optional[str]:
+    return next((prefix for prefix in SECTION_HEADERS if line.startswith(prefix)), None)
+
+
+def _opens_subsection(parent: Optional[str], line: str) -> bool:
+    return parent is not None and line.startswith(SUBSECTION_HEADERS.get(parent, ()))
+
+
+def parse_config(cli_text: str) -> ConfigTree:
+    """
+    Parses IOS-style CLI text into a hierarchical tree. Section membership
+    follows the IOS mode context: a section header (interface, router,
+    route-map, ...) opens a section that lasts until 'exit', the next header
+    or a global-only command, so flat (unindented) generated configs parse
+    the same as indented ones. Deeper indentation also nests a line under
+    the preceding one. 'exit' leaves one mode level; configure terminal /
+    end / write memory are dropped.
+    """
+    root: ConfigTree = {}
+    # (缩进, 子树, 段落头前缀 —— 普通行为 None)
+    stack: List[Tuple[int, ConfigTree, Optional[str]]] = [(-1, root, None)]
+    for raw in cli_text.splitlines():
+        if not raw.strip() or raw.strip().startswith("!"):
+            continue
+        indent = len(raw) - len(raw.lstrip())
+        line = " ".join(raw.split())
+        if line == "exit" or line.startswith("exit-"):
+            # 退出一层模式 (以及其下按缩进挂接的普通行)
+            while len(stack) > 1 and stack[-1][2] is None:
+                stack.pop()
+            if len(stack) > 1:
+                stack.pop()
+            continue
+        if line in MODE_COMMANDS:
+            del stack[1:]
+            continue
+
+        while stack[-1][0] > indent:
+            stack.pop()
+        if indent <= stack[-1][0] and line.startswith(GLOBAL_COMMANDS):
+            del stack[1:]
+        # 该行是否进入新的模式：段落头，或某个上层段落的子模式 (例如 policy-map 下的下一个 class)
+        opens_mode = _header(line) is not None or any(_opens_subsection(kind, line) for _, _, kind in stack)
+        # 同一缩进：普通行互为兄弟；模式只接纳其子模式，其余命令在无缩进时仍属于当前模式
+        while len(stack) > 1 and stack[-1][0] == indent:
+            kind = stack[-1][2]
+            if kind is None or (opens_mode and not _opens_subsection(kind, line)):
+                stack.pop()
+            else:
+                break
+        parent_kind = stack[-1][2]
+        children = stack[-1][1].setdefault(line, {})
+        kind = _header(line) or next((p for p in SUBSECTION_HEADERS.get(parent_kind, ()) if line.startswith(p)), None)
+        stack.append((indent, children, kind))
+    return root
+
+
+def _negated(line: str) -> Optional[str]:
+    return line[3:] if line.startswith("no ") else None
+
+
+def _setting(line: str) -> Optional[str]:
+    """The single-valued setting a line assigns (e.g. 'service-policy output'), or None."""
+    return next((key for key in SINGLE_VALUED if line == key or line.startswith(key + " ")), None)
+
+
+def _removed_by(negated: str, running: ConfigTree) -> List[str]:
+    """Running lines removed by 'no <negated>': the exact line, or every value of a bare setting ('no description')."""
+    if negated in running:
+        return [negated]
+    if _setting(negated) == negated:
+        return [line for line in running if _setting(line) == negated]
+    return []
+
+
+def diff_config(running: ConfigTree, candidate: ConfigTree, authoritative: bool = False) -> ConfigTree:
+    """
+    Minimal set of commands that makes `running` match the candidate.
+    - A line already present (with identical children) is dropped.
+    - A section that exists keeps its header and only the changed children.
+    - A new value of a single-valued setting (ip address, description,
+      service-policy output, ...) is preceded by 'no <old value>'.
+    - 'no X' is always kept, unless `running` is authoritative (seeded from
+      the device) and X is not configured: otherwise the tree only knows our
+      own pushes and X may well exist on the device.
+    """
+    delta: ConfigTree = {}
+    for line, children in candidate.items():
+        negated = _negated(line)
+        if negated is not None:
+            if not authoritative or _removed_by(negated, running):
+                delta[line] = {}
+            continue
+        if line not in running:
+            setting = _setting(line)
+            if setting is not None:
+                for old in running:
+                    if _setting(old) == setting:
+                        delta[f"no {old}"] = {}
+            delta[line] = children
+            continue
+        child_delta = diff_config(running[line], children, authoritative)
+        if child_delta:
+            delta[line] = child_delta
+    return delta
+
+
+def merge_config(running: ConfigTree, delta: ConfigTree):
+    """Applies a delta to a running tree in place ('no X' removes X; a single-valued setting replaces its old value)."""
+    for line, children in delta.items():
+        negated = _negated(line)
+        if negated is not None:
+            for old in _removed_by(negated, running):
+                running.pop(old, None)
+            continue
+        setting = _setting(line)
+        if setting is not None:
+            for old in [old for old in running if old != line and _setting(old) == setting]:
+                running.pop(old)
+        merge_config(running.setdefault(line, {}), children)
+
+
+def render_config(tree: ConfigTree, depth: int = 0) -> List[str]:
+    lines = []
+    for line, children in tree.items():
+        lines.append(" " * depth + line)
+        if children:
+            lines.extend(render_config(children, depth + 1))
+            lines.append(" " * depth + "exit")
+    return lines
+
+
+def count_lines(tree: ConfigTree) -> int:
+    return sum(1 + count_lines(children) for children in tree.values())
+
+
+class RunningConfigStore:
+    """
+    Per-device running-config store, indexed by device id then by section
+    header, so a diff only touches the sections present in the candidate.
+    Updated after every successful push and persisted as one JSON file per
+    device under `persist_dir`, shared by all workers (and replicas pointing
+    at the same directory): `lock()` serializes a device across processes and
+    reloads its persisted tree, so every diff sees the latest pushes. Only a
+    device seeded with its actual running-config (`seed()`) is authoritative
+    enough to drop 'no X' for lines it does not contain.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.persist_dir = persist_dir
+        self._devices: Dict[str, ConfigTree] = {}
+        os.makedirs(persist_dir, exist_ok=True)
+
+    def _path(self, device_id: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in device_id)
+        return os.path.join(self.persist_dir, f"{safe}.json")
+
+    def _seed_marker(self, device_id: str) -> str:
+        return self._path(device_id)[:-len(".json")] + ".seeded"
+
+    def _load(self, device_id: str) -> ConfigTree:
+        try:
+            with open(self._path(device_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @contextmanager
+    def lock(self, device_id: str) -> Iterator[None]:
+        """Per-device lock across threads and workers: diff + push + update must not interleave for one device."""
+        with cross_worker_lock(f"device-{device_id}", self.persist_dir):
+            # 持锁后重新加载：其他 worker 可能刚推送过这台设备
+            self._devices[device_id] = self._load(device_id)
+            yield
+
+    def get(self, device_id: str) -> ConfigTree:
+        tree = self._devices.get(device_id)
+        if tree is None:
+            tree = self._devices[device_id] = self._load(device_id)
+        return tree
+
+    def is_seeded(self, device_id: str) -> bool:
+        return os.path.exists(self._seed_marker(device_id))
+
+    def diff(self, device_id: str, cli_text: str) -> ConfigTree:
+        return diff_config(self.get(device_id), parse_config(cli_text), authoritative=self.is_seeded(device_id))
+
+    def seed(self, device_id: str, cli_text: str):
+        """Replaces a device's tree with its actual running-config (e.g. 'show running-config' output)."""
+        self._devices[device_id] = parse_config(cli_text)
+        self._save(device_id)
+        open(self._seed_marker(device_id), "a").close()
+
+    def apply(self, device_id: str, delta: ConfigTree):
+        merge_config(self.get(device_id), delta)
+        self._save(device_id)
+
+    def _save(self, device_id: str):
+        running = self.get(device_id)
+        tmp_path = f"{self._path(device_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(running, f)
+        os.replace(tmp_path, self._path(device_id))
+
+    def show(self, device_id: str) -> str:
+        return "\n".join(render_config(self._load(device_id)))
+
+
+def build_push_script(delta: ConfigTree) -> str:
+    """Wraps a delta into an executable CLI session that also persists the config."""
+    return "\n".join(["configure terminal", *render_config(delta), "end", "write memory"])
@@ -0,0 +1,151 @@
+import argparse
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import uvicorn
+
+# 父进程 (pre-fork) 与各 worker 共享的目录：只读快照 + 跨进程文件锁
+SHARED_DIR_ENV = "QOS_SHARED_DIR"
+WORKERS_ENV = "AGENT_WORKERS"
+
+# 进程生命周期内持有的锁文件句柄 (关闭即释放)
+_held_locks: Dict[str, Any] = {}
+
+
+def shared_dir() -> str:
+    path = os.environ.get(SHARED_DIR_ENV) or os.path.join(tempfile.gettempdir(), "qos-system")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def publish_shared_state(name: str, data: Any):
+    """Writes a read-only JSON snapshot that every worker can load at startup."""
+    path = os.path.join(shared_dir(), f"{name}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_shared_state(name: str) -> Optional[Any]:
+    """Loads a snapshot published by the parent process, or None if there is none."""
+    path = os.path.join(shared_dir(), f"{name}.json")
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def shared_state_mtime(name: str) -> float:
+    """Modification time of a snapshot (0.0 if missing), to cheaply detect updates."""
+    try:
+        return os.path.getmtime(os.path.join(shared_dir(), f"{name}.json"))
+    except OSError:
+        return 0.0
+
+
+def _lock_path(name: str, directory: Optional[str] = None) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    return os.path.join(directory or shared_dir(), f"{safe}.lock")
+
+
+@contextmanager
+def cross_worker_lease(name: str):
+    """
+    Non-blocking, cross-process exclusive lease (flock on a file in the shared dir).
+    Yields True if this worker holds the lease, False if another worker does.
+    """
+    with open(_lock_path(name), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def cross_worker_lock(name: str, directory: Optional[str] = None):
+    """
+    Blocking, cross-process exclusive lock (flock), for short read-modify-write
+    sections on shared files. The lock file lives in `directory` (default: the
+    shared dir); pass the directory of the protected data when processes with
+    different shared dirs (e.g. replicas) write it.
+    """
+    with open(_lock_path(name, directory), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def acquire_singleton(name: str, directory: Optional[str] = None) -> bool:
+    """
+    Elects exactly one worker for a process-wide role (e.g. a background loop).
+    The lock is held until the process exits. With `directory`, the election
+    spans every process using that directory, not just this launch's workers.
+    """
+    if name in _held_locks:
+        return True
+    f = open(_lock_path(name, directory), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return False
+    _held_locks[name] = f
+    return True
+
+
+def worker_lifespan(on_startup: Iterable[Callable[[], Any]] = (), on_shutdown: Iterable[Callable[[], Any]] = ()):
+    """
+    FastAPI lifespan running the per-worker startup / shutdown hooks
+    (replaces the startup / shutdown event handlers, removed in Starlette 1.x).
+    """
+    on_startup, on_shutdown = list(on_startup), list(on_shutdown)
+
+    @asynccontextmanager
+    async def lifespan(app: Any):
+        for hook in on_startup:
+            hook()
+        try:
+            yield
+        finally:
+            for hook in on_shutdown:
+                hook()
+
+    return lifespan
+
+
+def serve(app_import: str, app: Any, host: str, port: int, prepare: Callable[[], None] = None):
+    """
+    Runs an agent server with one or more worker processes.
+    Pre-fork phase (parent, once): create the shared dir and run `prepare`
+    to publish read-only snapshots. Per-worker phase: each worker imports
+    `app_import` ("module:attr") and builds its own clients in the app's
+    startup handlers. Worker count comes from --workers or AGENT_WORKERS.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(os.getenv(WORKERS_ENV, "1")))
+    args, _ = parser.parse_known_args()
+
+    # 每次启动使用独立的共享目录，worker 通过环境变量继承 (已显式设置 QOS_SHARED_DIR 时不再创建)
+    if not os.environ.get(SHARED_DIR_ENV):
+        os.environ[SHARED_DIR_ENV] = tempfile.mkdtemp(prefix=f"qos-system-{port}-")
+    if prepare is not None:
+        prepare()
+
+    if args.workers > 1:
+        print(f"Serving {app_import} with {args.workers} workers (shared dir {shared_dir()})")
+        uvicorn.run(app_import, host=host, port=port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,122 @@
+"""
+Startup profiling report and cold-start budget check for the agents.
+
+Each agent module is imported in a fresh interpreter with `-X importtime`
+(this includes building the module-level agent object, i.e. everything that
+happens before the port opens). The report lists, per agent, the import
+cost grouped by top-level package (e.g. fastapi, pydantic, langchain_core)
+and the individual modules with the highest self time, nested imports
+included; the process exits with status 1 if any agent exceeds the budget,
+so it can gate CI or a rolling deploy.
+
+Usage (from qos-system/):
+    python -m agents.startup_profile [--budget-ms 1500] [--top 10] [module ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+AGENT_MODULES = [
+    "agents.1_qos_monitor",
+    "agents.2_qos_remediation",
+    "agents.3_config_generator",
+    "agents.4_config_validator",
+    "agents.5_config_executor",
+    "agents.6_orchestrator",
+]
+
+DEFAULT_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+
+_SNIPPET = (
+    "import importlib, time\n"
+    "t = time.perf_counter()\n"
+    "importlib.import_module({module!r})\n"
+    "print('COLD_START_MS=%.1f' % ((time.perf_counter() - t) * 1000))\n"
+)
+
+
+def _parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parses `-X importtime` output into one entry per imported module (module, depth, self_ms, cumulative_ms)."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            self_ms, cumulative_ms = int(self_us) / 1000.0, int(cumulative_us) / 1000.0
+        except ValueError:
+            continue
+        # 嵌套深度：每层嵌套在名字前多两个空格
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append({"module": name.strip(), "depth": depth, "self_ms": self_ms, "cumulative_ms": cumulative_ms})
+    return entries
+
+
+def _by_package(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sums self time per top-level package, so e.g. all of pydantic's submodules count as pydantic."""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        package = entry["module"].split(".", 1)[0]
+        total = totals.setdefault(package, {"package": package, "self_ms": 0.0, "modules": 0})
+        total["self_ms"] += entry["self_ms"]
+        total["modules"] += 1
+    return sorted(totals.values(), key=lambda t: t["self_ms"], reverse=True)
+
+
+def profile_module(module: str) -> Dict[str, Any]:
+    """Cold-imports one agent module in a subprocess and returns its timing profile."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, AGENT_WORKERS="1", ALARM_PUSH_INTERVAL="0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SNIPPET.format(module=module)],
+        cwd=root, env=env, capture_output=True, text=True
+    )
+    result: Dict[str, Any] = {"module": module, "ok": proc.returncode == 0, "cold_start_ms": None}
+    for line in proc.stdout.splitlines():
+        if line.startswith("COLD_START_MS="):
+            result["cold_start_ms"] = float(line.split("=", 1)[1])
+    entries = _parse_importtime(proc.stderr)
+    result["packages"] = _by_package(entries)
+    result["imports"] = sorted(entries, key=lambda e: e["self_ms"], reverse=True)
+    if not result["ok"]:
+        result["error"] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+    return result
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-agent import-time report and cold-start budget check.")
+    parser.add_argument("modules", nargs="*", default=AGENT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for module in args.modules:
+        result = profile_module(module)
+        print(f"\n=== {module} ===")
+        if not result["ok"]:
+            print(f"  IMPORT FAILED: {result['error']}")
+            over_budget.append(module)
+            continue
+        status = "OK" if result["cold_start_ms"] <= args.budget_ms else "OVER BUDGET"
+        print(f"  cold start: {result['cold_start_ms']:.1f} ms (budget {args.budget_ms:.0f} ms) [{status}]")
+        print("  by package (self time):")
+        for total in result["packages"][:args.top]:
+            print(f"  {total['self_ms']:9.1f} ms  {total['package']} ({total['modules']} modules)")
+        print("  slowest modules (self / cumulative):")
+        for entry in result["imports"][:args.top]:
+            print(f"  {entry['self_ms']:9.1f} ms / {entry['cumulative_ms']:9.1f} ms  {entry['module']}")
+        if status != "OK":
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"\nStartup budget check FAILED for: {', '.join(over_budget)}")
+        return 1
+    print("\nStartup budget check passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+import array
+import bisect
+import json
+import math
+import mmap
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 汇总粒度 (秒)；原始数据与各粒度汇总按时间分区，每个分区每列一个追加写文件
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+PARTITION_SECONDS = {"raw": 86400, "1m": 86400, "1h": 30 * 86400, "1d": 365 * 86400}
+METRICS = ("load_mbps", "utilization", "latency_ms")
+STATS = ("min", "max", "mean", "p95")
+SCAN_CHUNK_ROWS = 4096
+
+# 列名 -> array 类型码 (d: float64, I: uint32, f: float32)
+RAW_COLUMNS = {"ts": "d", "link": "I", **{metric: "f" for metric in METRICS}}
+ROLLUP_COLUMNS = {"ts": "d", "link": "I", "count": "I", **{f"{metric}_{stat}": "f" for metric in METRICS for stat in STATS}}
+
+
+class QuantileSketch:
+    """
+    Streaming min/max/mean and approximate quantiles in constant memory:
+    values are counted in log-spaced bins (relative error ~1%).
+    """
+
+    GAMMA = 1.02
+    _LOG_GAMMA = math.log(GAMMA)
+
+    __slots__ = ("count", "total", "min", "max", "zeros", "bins")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zeros = 0
+        self.bins: Dict[int, int] = {}
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self._LOG_GAMMA)
+            self.bins[key] = self.bins.get(key, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return self.min
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # bin (gamma^(k-1), gamma^k] 的代表值，限制在观测到的 [min, max] 内
+                estimate = 2 * self.GAMMA ** key / (self.GAMMA + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Tuple[float, float, float, float]:
+        return self.min, self.max, self.total / self.count, self.quantile(0.95)
+
+
+class _Table:
+    """
+    Append-only columnar table split into time partitions
+    (<root>/<name>/<partition start>/<column>.col). Rows are appended in
+    time order, so the ts column of a partition is sorted and range scans
+    bisect into it. Reads memory-map the column files.
+    """
+
+    def __init__(self, root: str, name: str, columns: Dict[str, str], partition_seconds: int):
+        self.path = os.path.join(root, name)
+        self.columns = columns
+        self.partition_seconds = partition_seconds
+        self._writers: Dict[str, Any] = {}
+        self._writer_partition: Optional[int] = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def partitions(self) -> List[int]:
+        return sorted(int(entry) for entry in os.listdir(self.path) if entry.isdigit())
+
+    def _partition_of(self, ts: float) -> int:
+        return int(ts // self.partition_seconds * self.partition_seconds)
+
+    def append(self, rows: List[Tuple]):
+        """Appends rows (tuples in column order, non-decreasing ts)."""
+        start = 0
+        while start < len(rows):
+            partition = self._partition_of(rows[start][0])
+            end = start
+            while end < len(rows) and self._partition_of(rows[end][0]) == partition:
+                end += 1
+            self._write(partition, rows[start:end])
+            start = end
+
+    def _write(self, partition: int, rows: List[Tuple]):
+        if partition != self._writer_partition:
+            self.close()
+            directory = os.path.join(self.path, str(partition))
+            os.makedirs(directory, exist_ok=True)
+            self._writers = {name: open(os.path.join(directory, f"{name}.col"), "ab") for name in self.columns}
+            self._writer_partition = partition
+        for index, (name, typecode) in enumerate(self.columns.items()):
+            self._writers[name].write(array.array(typecode, [row[index] for row in rows]).tobytes())
+        for f in self._writers.values():
+            f.flush()
+
+    def close(self):
+        for f in self._writers.values():
+            f.close()
+        self._writers = {}
+        self._writer_partition = None
+
+    @contextmanager
+    def _mapped(self, partition: int) -> Iterator[Tuple[int, Dict[str, memoryview]]]:
+        """Memory-maps the columns of one partition; yields (row count, column views)."""
+        views: Dict[str, memoryview] = {}
+        with ExitStack() as stack:
+            for name, typecode in self.columns.items():
+                path = os.path.join(self.path, str(partition), f"{name}.col")
+                if not os.path.exists(path) or os.path.getsize(path) == 0:
+                    views = {}
+                    break
+                f = stack.enter_context(open(path, "rb"))
+                mapped = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                view = memoryview(mapped)
+                itemsize = array.array(typecode).itemsize
+                # 写入中途崩溃可能留下半行：按整行截断
+                views[name] = view[:len(view) // itemsize * itemsize].cast(typecode)
+                stack.callback(view.release)
+                stack.callback(views[name].release)
+            # 各列长度可能因并发追加而略有不同，只读取完整的行
+            rows = min((len(v) for v in views.values()), default=0)
+            yield rows, views
+
+    def scan(self, start: float, end: float) -> Iterator[Tuple[Dict[str, memoryview], int, int]]:
+        """Yields (column views, first row, end row) for rows with start <= ts < end, partition by partition."""
+        for partition in self.partitions():
+            if partition + self.partition_seconds <= start or partition >= end:
+                continue
+            with self._mapped(partition) as (rows, views):
+                if rows == 0:
+                    continue
+                ts = views["ts"]
+                lo = bisect.bisect_left(ts, start, 0, rows)
+                hi = bisect.bisect_left(ts, end, lo, rows)
+                if lo < hi:
+                    yield views, lo, hi
+
+    def last_ts(self) -> Optional[float]:
+        for partition in reversed(self.partitions()):
+            with self._mapped(partition) as (rows, views):
+                if rows:
+                    return views["ts"][rows - 1]
+        return None
+
+
+class TelemetryStore:
+    """
+    Embedded, append-only columnar store for per-link telemetry samples.
+    Raw samples and 1m / 1h / 1d rollups (min / max / mean / p95 of each
+    metric) live in memory-mapped column files partitioned by time. Rollups
+    are maintained incrementally on ingest: each link keeps one open bucket
+    per resolution, written out when time moves past it; a restarted writer
+    rebuilds its open buckets from the raw samples. Queries read the rollup
+    that keeps the number of scanned rows small, so trend queries over long
+    ranges stay fast and use constant memory.
+    Only one process may write (`writable=True`); others open it read-only
+    and see the written rollups only, not the writer's open buckets.
+    """
+
+    def __init__(self, root: str, writable: bool = True):
+        self.root = root
+        self.writable = writable
+        os.makedirs(root, exist_ok=True)
+        self.raw = _Table(root, "raw", RAW_COLUMNS, PARTITION_SECONDS["raw"])
+        self.rollups = {res: _Table(root, f"rollup_{res}", ROLLUP_COLUMNS, PARTITION_SECONDS[res]) for res in RESOLUTIONS}
+        self._lock = threading.Lock()
+        self._links_path = os.path.join(root, "links.json")
+        self._link_names: List[str] = []
+        self._link_ids: Dict[str, int] = {}
+        self._load_links()
+        # 每个粒度当前未写出的桶：起始时间 + {link_id: {metric: sketch}}
+        self._bucket_start: Dict[str, Optional[float]] = {res: None for res in RESOLUTIONS}
+        self._open: Dict[str, Dict[int, Dict[str, QuantileSketch]]] = {res: {} for res in RESOLUTIONS}
+        self._last_ts = self.raw.last_ts() or 0.0
+        self.counters = {"ingested": 0, "late_dropped": 0, "rollup_rows": 0}
+        if writable:
+            self._recover()
+
+    # --- 链路字典 ---
+    def _load_links(self):
+        if os.path.exists(self._links_path):
+            with open(self._links_path, "r") as f:
+                self._link_names = json.load(f)
+            self._link_ids = {name: index for index, name in enumerate(self._link_names)}
+
+    def _link_id(self, link: str) -> int:
+        link_id = self._link_ids.get(link)
+        if link_id is None:
+            link_id = len(self._link_names)
+            self._link_names.append(link)
+            self._link_ids[link] = link_id
+            tmp_path = f"{self._links_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._link_names, f)
+            os.replace(tmp_path, self._links_path)
+        return link_id
+
+    def links(self) -> List[str]:
+        if not self.writable:
+            self._load_links()
+        return list(self._link_names)
+
+    # --- 写入 ---
+    def _recover(self):
+        """Rebuilds the open buckets from raw samples newer than the last written rollup of each resolution."""
+        watermarks = {}
+        for res, seconds in RESOLUTIONS.items():
+            last = self.rollups[res].last_ts()
+            watermarks[res] = -math.inf if last is None else last + seconds
+        replay_from = min(watermarks.values())
+        if self._last_ts < replay_from:
+            return
+        for views, lo, hi in self.raw.scan(replay_from if replay_from > -math.inf else 0.0, math.inf):
+            for i in range(lo, hi):
+                ts = views["ts"][i]
+                values = {metric: views[metric][i] for metric in METRICS}
+                for res in RESOLUTIONS:
+                    if ts >= watermarks[res]:
+                        self._add_to_bucket(res, ts, views["link"][i], values)
+
+    def _flush_bucket(self, res: str):
+        start = self._bucket_start[res]
+        rows = []
+        for link_id in sorted(self._open[res]):
+            sketches = self._open[res][link_id]
+            row = [start, link_id, sketches[METRICS[0]].count]
+            for metric in METRICS:
+                row.extend(sketches[metric].summary())
+            rows.append(tuple(row))
+        if rows:
+            self.rollups[res].append(rows)
+            self.counters["rollup_rows"] += len(rows)
+        self._open[res] = {}
+
+    def _add_to_bucket(self, res: str, ts: float, link_id: int, values: Dict[str, float]):
+        seconds = RESOLUTIONS[res]
+        bucket_start = ts // seconds * seconds
+        if self._bucket_start[res] is not None and bucket_start > self._bucket_start[res]:
+            self._flush_bucket(res)
+        if self._bucket_start[res] is None or bucket_start > self._bucket_start[res]:
+            self._bucket_start[res] = bucket_start
+        sketches = self._open[res].get(link_id)
+        if sketches is None:
+            sketches = self._open[res][link_id] = {metric: QuantileSketch() for metric in METRICS}
+        for metric in METRICS:
+            sketches[metric].add(values[metric])
+
+    def ingest(self, samples: List[Dict[str, Any]]) -> int:
+        """
+        Appends samples ({"link": "A->B", "ts": epoch seconds, "load_mbps",
+        "utilization", "latency_ms"}) and updates the rollups. Samples older
+        than the newest stored one are dropped (the store is append-only).
+        Returns the number of samples stored.
+        """
+        if not self.writable:
+            raise PermissionError("Telemetry store is opened read-only")
+        with self._lock:
+            rows = []
+            for sample in sorted(samples, key=lambda s: s.get("ts", 0.0)):
+                ts = float(sample.get("ts") or time.time())
+                if ts < self._last_ts:
+                    self.counters["late_dropped"] += 1
+                    continue
+                link_id = self._link_id(sample["link"])
+                values = {metric: float(sample.get(metric, 0.0)) for metric in METRICS}
+                rows.append((ts, link_id, *(values[metric] for metric in METRICS)))
+                for res in RESOLUTIONS:
+                    self._add_to_bucket(res, ts, link_id, values)
+                self._last_ts = ts
+            if rows:
+                self.raw.append(rows)
+                self.counters["ingested"] += len(rows)
+            return len(rows)
+
+    def close(self):
+        with self._lock:
+            self.raw.close()
+            for table in self.rollups.values():
+                table.close()
+
+    # --- 查询 ---
+    @staticmethod
+    def pick_resolution(span_seconds: float) -> str:
+        """Finest rollup that keeps a range under ~400 buckets per link."""
+        if span_seconds <= 6 * 3600:
+            return "1m"
+        if span_seconds <= 14 * 86400:
+            return "1h"
+        return "1d"
+
+    def _open_bucket(self, res: str, link_id: int, start: float, end: float) -> Optional[Tuple]:
+        """In-memory (not yet written) bucket of a link as a full rollup row, if it falls in [start, end)."""
+        with self._lock:
+            bucket_start = self._bucket_start.get(res)
+            sketches = self._open.get(res, {}).get(link_id)
+            if sketches is None or bucket_start is None or not (start <= bucket_start < end):
+                return None
+            row = [bucket_start, link_id, sketches[METRICS[0]].count]
+            for metric in METRICS:
+                row.extend(sketches[metric].summary())
+            return tuple(row)
+
+    def _rollup_rows(self, res: str, start: float, end: float, names: List[str], link_id: Optional[int] = None) -> Iterator[Tuple]:
+        """Values of the `names` columns for rollup buckets starting in [start, end), optionally for one link."""
+        seconds = RESOLUTIONS[res]
+        aligned = start // seconds * seconds
+        for views, lo, hi in self.rollups[res].scan(aligned, end):
+            links = views["link"]
+            columns = [views[name] for name in names]
+            if link_id is None:
+                # 分块转换，内存占用与分区大小无关
+                for chunk in range(lo, hi, SCAN_CHUNK_ROWS):
+                    chunk_end = min(chunk + SCAN_CHUNK_ROWS, hi)
+                    yield from zip(*(column[chunk:chunk_end].tolist() for column in columns))
+            else:
+                for i in range(lo, hi):
+                    if links[i] == link_id:
+                        yield tuple(column[i] for column in columns)
+        positions = [list(ROLLUP_COLUMNS).index(name) for name in names]
+        if link_id is not None:
+            links = [link_id]
+        else:
+            with self._lock:
+                links = list(self._open[res])
+        for open_link in links:
+            row = self._open_bucket(res, open_link, aligned, end)
+            if row is not None:
+                yield tuple(row[position] for position in positions)
+
+    def query_range(self, link: str, start: float, end: float, metric: str = "utilization",
+                    resolution: Optional[str] = None, limit: int = 2000) -> Dict[str, Any]:
+        """Time series of one link's metric: rollup buckets (count/min/max/mean/p95) or raw samples."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric} (expected one of {', '.join(METRICS)})")
+        resolution = resolution or self.pick_resolution(end - start)
+        if resolution != "raw" and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        self.links()
+        link_id = self._link_ids.get(link)
+        points: List[Dict[str, Any]] = []
+        truncated = False
+        if link_id is not None and resolution == "raw":
+            for views, lo, hi in self.raw.scan(start, end):
+                ts, links, values = views["ts"], views["link"], views[metric]
+                for i in range(lo, hi):
+                    if links[i] == link_id:
+                        if len(points) >= limit:
+                            truncated = True
+                            break
+                        points.append({"ts": ts[i], "value": round(values[i], 4)})
+                if truncated:
+                    break
+        elif link_id is not None:
+            names = ["ts", "count"] + [f"{metric}_{stat}" for stat in STATS]
+            for row in self._rollup_rows(resolution, start, end, names, link_id):
+                if len(points) >= limit:
+                    truncated = True
+                    break
+                points.append({"ts": row[0], "count": row[1], **{stat: round(value, 4) for stat, value in zip(STATS, row[2:])}})
+        return {"link": link, "metric": metric, "resolution": resolution, "start": start, "end": end,
+                "points": points, "truncated": truncated}
+
+    def top_congested(self, start: float, end: float, n: int = 5, metric: str = "utilization",
+                      stat: str = "p95", resolution: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        The n links with the highest `stat` of `metric` over [start, end).
+        mean is count-weighted; max and p95 are the worst bucket value
+        (p95 = the worst bucket-level 95th percentile).
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric} (expected one of {', '.join(METRICS)})")
+        if stat not in STATS:
+            raise ValueError(f"Unknown stat: {stat} (expected one of {', '.join(STATS)})")
+        resolution = resolution or self.pick_resolution(end - start)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Top-N queries need a rollup resolution ({', '.join(RESOLUTIONS)})")
+        names = ["link", "count"] + [f"{metric}_{s}" for s in STATS]
+        # 每条链路一个累加器，内存只与链路数有关
+        totals: Dict[int, List[float]] = {}
+        for link_id, count, low, high, mean, p95 in self._rollup_rows(resolution, start, end, names):
+            acc = totals.get(link_id)
+            if acc is None:
+                totals[link_id] = [count, mean * count, low, high, p95]
+            else:
+                acc[0] += count
+                acc[1] += mean * count
+                acc[2] = min(acc[2], low)
+                acc[3] = max(acc[3], high)
+                acc[4] = max(acc[4], p95)
+        names = self.links()
+        ranked = []
+        for link_id, (count, weighted, low, high, p95) in totals.items():
+            values = {"min": low, "max": high, "mean": weighted / count if count else 0.0, "p95": p95}
+            ranked.append({"link": names[link_id], "samples": int(count), **{k: round(v, 4) for k, v in values.items()}})
+        ranked.sort(key=lambda entry: entry[stat], reverse=True)
+        return ranked[:n]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"links": len(self._link_names), "last_ts": self._last_ts, **self.counters}
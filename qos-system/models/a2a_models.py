@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Any, Literal
+from typing import Dict, Any, List, Literal, Optional
 
 # --- Core A2A/Agent Card Models ---
 
@@ -29,6 +29,10 @@ class A2AMessage(BaseModel):
     receiver_id: str
     content_type: str = "application/json"
     payload: Dict[str, Any]
+    # 跨 Agent 的追踪 ID，用于关联同一条 Chain 的日志
+    trace_id: Optional[str] = None
+    # 发送方停止等待的时间点 (epoch 秒)，接收方据此决定排队或直接拒绝
+    deadline: Optional[float] = None
 
 # --- Business Data Models ---
 
@@ -53,11 +57,19 @@ class CLIConfig(BaseModel):
     cli_text: str
     device_type: str = "Cisco"
 
+class CLIConfigBatch(BaseModel):
+    # Output of Config Generation Agent for a batch of plans (same order as the input)
+    configs: List[CLIConfig]
+
 class ValidationResult(BaseModel):
     # Output of Config Validation Agent
     is_valid: bool
     report: str
 
+class ValidationResultBatch(BaseModel):
+    # Output of Config Validation Agent for a batch of configs (same order as the input)
+    results: List[ValidationResult]
+
 class ExecutionStatus(BaseModel):
     # Output of Config Execution Agent
     status: Literal["Success", "Failure", "Rollback"]
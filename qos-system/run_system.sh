@@ -3,6 +3,18 @@
 # 确保已安装依赖：pip install -r requirements.txt
 # 确保 GEMINI_API_KEY 已设置
 # 运行前请确保当前目录是 qos-system/ 
+# 多进程：设置 AGENT_WORKERS=N (或给单个 Agent 传 --workers N) 即可为每个 Agent 启动 N 个 worker
+# 多副本：AGENT_PORT=8013 ORCHESTRATOR_URL=http://localhost:8006 python3 -m agents.3_config_generator 会再启动一个副本并向编排者注册
+# (副本会一直重试注册，之后每 REGISTRY_HEARTBEAT_INTERVAL 秒 (默认 30) 重新注册一次，因此可先于编排者启动，编排者重启后也会自动恢复)
+# (或在启动编排者前设置 AGENT_REPLICA_URLS={"Config Generation Agent": ["http://localhost:8013/.well-known/agent.json"]})
+# 执行 Agent 把每台设备的 running-config 副本保存在 RUNNING_CONFIG_DIR (默认 qos-system/running_config_data/，重启后保留，所有 worker 与副本共用)；
+# 请求中附带 running_config (设备的 show running-config 输出) 后，该设备的差异以设备实际配置为准，否则 'no X' 命令总是下发
+# 录制/回放：CASSETTE_MODE=record CASSETTE_PATH=run.jsonl 录制所有 A2A / Gemini / Neo4j 交互；CASSETTE_MODE=replay 离线回放
+# (CASSETTE_TIMING=original 按原始耗时回放)；python -m agents.cassette run.jsonl 汇总各类交互的录制耗时
+# 告警推送：默认关闭，由下方的 start_qos_chain 调用触发一次修复；设置 ALARM_PUSH_INTERVAL=2 后监控 Agent 会主动推送告警
+# (持续告警每 ALARM_REPEAT_INTERVAL 秒重推一次，每次都会运行一条 Gemini Chain)，此时无需再调用 start_qos_chain
+# 链路时序库：监控 Agent 每 TELEMETRY_SAMPLE_INTERVAL 秒 (默认 10，0 关闭) 采样一次，写入 TELEMETRY_DIR (默认 qos-system/telemetry_data/，重启后保留历史)；
+# 通过 query_telemetry 能力查询区间序列 (query=range) 或最拥塞链路 (query=top_congested)，按时间跨度自动选用 1m/1h/1d 汇总
 
 # 函数：启动一个 Agent (使用 -m 选项，解决导入问题)
 start_agent() {